@@ -0,0 +1,183 @@
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException, status
+
+from app import metrics
+from app.db import engine
+from app.logger import logger
+from app.schema import ResponseType
+
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() == "true"
+# По умолчанию одновременно допускается столько бронирований, сколько соединений в пуле воркера
+ADMISSION_MAX_CONCURRENCY = int(os.getenv("ADMISSION_MAX_CONCURRENCY", "0")) or getattr(engine.pool, "size", lambda: 5)()
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "256"))
+ADMISSION_PRODUCT_CONCURRENCY = int(os.getenv("ADMISSION_PRODUCT_CONCURRENCY", "2"))
+ADMISSION_PRODUCT_QUEUE_SIZE = int(os.getenv("ADMISSION_PRODUCT_QUEUE_SIZE", "32"))
+ADMISSION_MAX_WAIT_MS = int(os.getenv("ADMISSION_MAX_WAIT_MS", "1000"))
+
+SERVICE_TIME_SMOOTHING = 0.2
+
+
+class Overloaded(Exception):
+    def __init__(self, status_code: int, message: str, retry_after: float):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.retry_after = retry_after
+
+
+class Gate:
+    # Семафор с FIFO-очередью, глубину которой видно снаружи
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.waiters: deque[asyncio.Future] = deque()
+
+    @property
+    def idle(self) -> bool:
+        return self.in_flight == 0 and not self.waiters
+
+    async def acquire(self, timeout: float) -> None:
+        if self.in_flight < self.limit and not self.waiters:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                # Слот уже передан этому запросу, возвращаем его следующему
+                self.release()
+            elif waiter in self.waiters:
+                self.waiters.remove(waiter)
+            raise
+
+    def release(self) -> None:
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_concurrency: int = ADMISSION_MAX_CONCURRENCY,
+        queue_size: int = ADMISSION_QUEUE_SIZE,
+        product_concurrency: int = ADMISSION_PRODUCT_CONCURRENCY,
+        product_queue_size: int = ADMISSION_PRODUCT_QUEUE_SIZE,
+        max_wait_ms: int = ADMISSION_MAX_WAIT_MS,
+        enabled: bool = ADMISSION_CONTROL,
+    ):
+        self.enabled = enabled
+        self.queue_size = queue_size
+        self.product_concurrency = product_concurrency
+        self.product_queue_size = product_queue_size
+        self.max_wait = max_wait_ms / 1000
+        self.global_gate = Gate(max_concurrency)
+        self.product_gates: dict[int, Gate] = {}
+        self.service_time = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self.global_gate.waiters) + sum(len(gate.waiters) for gate in self.product_gates.values())
+
+    def estimated_wait(self, waiting: int, limit: int) -> float:
+        return (waiting // limit + 1) * self.service_time
+
+    def _shed(self, status_code: int, message: str, wait: float) -> Overloaded:
+        metrics.inc(f"admission.shed.{status_code}")
+        return Overloaded(status_code, message, max(wait, self.service_time, 0.001))
+
+    def _check(self, gate: Gate, queue_size: int, status_code: int, message: str, deadline: float) -> None:
+        if gate.in_flight < gate.limit and not gate.waiters:
+            return
+        wait = self.estimated_wait(len(gate.waiters), gate.limit)
+        if len(gate.waiters) >= queue_size or wait > deadline:
+            raise self._shed(status_code, message, wait)
+
+    async def _acquire(self, gate: Gate, timeout: float, status_code: int, message: str) -> None:
+        try:
+            await gate.acquire(max(timeout, 0))
+        except asyncio.TimeoutError:
+            raise self._shed(status_code, message, self.estimated_wait(len(gate.waiters), gate.limit))
+
+    def _release_product(self, product_id: int, product_gate: Gate | None) -> None:
+        if product_gate is None:
+            return
+        product_gate.release()
+        if product_gate.idle:
+            self.product_gates.pop(product_id, None)
+
+    @asynccontextmanager
+    async def admit(self, product_id: int, deadline: float | None = None, per_product: bool = True):
+        if not self.enabled:
+            yield
+            return
+
+        budget = self.max_wait if deadline is None else min(self.max_wait, deadline)
+        started = time.perf_counter()
+
+        # Сначала очередь товара: запросы к горячему товару не должны занимать общие слоты, пока ждут.
+        # Товары в леджере её пропускают: бронь решается в памяти и не держит блокировку строки
+        product_gate = None
+        if per_product:
+            product_gate = self.product_gates.get(product_id)
+            if product_gate is None:
+                product_gate = self.product_gates[product_id] = Gate(self.product_concurrency)
+            product_message = "Too many concurrent reservations for this product."
+            try:
+                self._check(
+                    product_gate, self.product_queue_size, status.HTTP_429_TOO_MANY_REQUESTS, product_message, budget
+                )
+                await self._acquire(product_gate, budget, status.HTTP_429_TOO_MANY_REQUESTS, product_message)
+            except BaseException:
+                if product_gate.idle:
+                    self.product_gates.pop(product_id, None)
+                raise
+
+        global_message = "Service overloaded, retry later."
+        try:
+            remaining = budget - (time.perf_counter() - started)
+            self._check(self.global_gate, self.queue_size, status.HTTP_503_SERVICE_UNAVAILABLE, global_message, remaining)
+            await self._acquire(self.global_gate, remaining, status.HTTP_503_SERVICE_UNAVAILABLE, global_message)
+        except BaseException:
+            self._release_product(product_id, product_gate)
+            raise
+
+        metrics.inc("admission.admitted")
+        admitted = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - admitted
+            self.service_time += SERVICE_TIME_SMOOTHING * (elapsed - self.service_time)
+            self.global_gate.release()
+            self._release_product(product_id, product_gate)
+
+
+def overloaded_response(error: Overloaded) -> HTTPException:
+    logger.warning(f"Reservation shed with {error.status_code}: {error.message}")
+    return HTTPException(
+        status_code=error.status_code,
+        detail={
+            "status": ResponseType.error.value,
+            "message": error.message,
+            "reservation_id": None
+        },
+        headers={"Retry-After": str(math.ceil(error.retry_after))},
+    )
+
+
+admission_controller = AdmissionController()
+metrics.register_gauge("admission.in_flight", lambda: admission_controller.global_gate.in_flight)
+metrics.register_gauge("admission.queue_depth", lambda: admission_controller.queue_depth)
+metrics.register_gauge("admission.service_time_ms", lambda: round(admission_controller.service_time * 1000, 3))
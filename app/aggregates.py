@@ -0,0 +1,200 @@
+import asyncio
+import os
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import Date, bindparam, delete, func, or_, select, text, type_coerce, union_all, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import new_session
+from app.logger import logger
+from app.models import ReservationStatsModel, ReservationsModel, TaskStatus
+from app.writer import sqlite_writer
+
+STATS_RECONCILE_INTERVAL_SECONDS = int(os.getenv("STATS_RECONCILE_INTERVAL_SECONDS", "3600"))
+STATS_RECONCILE_DAYS = int(os.getenv("STATS_RECONCILE_DAYS", "7"))
+STATS_RECONCILE_LOCK_KEY = 7_270_003
+
+stats_table = ReservationStatsModel.__table__
+STATUS_ORDER = {status: index for index, status in enumerate(TaskStatus)}
+
+
+def _upsert_stats_stmt(insert):
+    stmt = insert(stats_table).values(
+        product_id=bindparam("stats_product_id"),
+        status=bindparam("stats_status", type_=stats_table.c.status.type),
+        bucket=bindparam("stats_bucket", type_=Date),
+        reservations_count=bindparam("count_delta"),
+        quantity_total=bindparam("quantity_delta"),
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[stats_table.c.product_id, stats_table.c.status, stats_table.c.bucket],
+        set_={
+            "reservations_count": stats_table.c.reservations_count + stmt.excluded.reservations_count,
+            "quantity_total": stats_table.c.quantity_total + stmt.excluded.quantity_total,
+        },
+    )
+
+
+# Счётчики только прибавляют дельту, поэтому upsert не читает строку и не мешает параллельным транзакциям
+upsert_stats_stmts = {
+    "postgresql": _upsert_stats_stmt(postgresql.insert),
+    "sqlite": _upsert_stats_stmt(sqlite.insert),
+}
+
+
+def stats_bucket(moment: datetime, dialect_name: str) -> date:
+    # SQLite хранит время без смещения, поэтому день берётся по записанному значению, как и в reconcile
+    if moment.tzinfo is not None and dialect_name != "sqlite":
+        moment = moment.astimezone(timezone.utc)
+    return moment.date()
+
+
+def bucket_expression(dialect_name: str):
+    if dialect_name == "postgresql":
+        return type_coerce(func.date(func.timezone("UTC", ReservationsModel.timestamp)), Date)
+    return type_coerce(func.date(ReservationsModel.timestamp), Date)
+
+
+async def record_reservation_stats(
+    session: AsyncSession,
+    product_id: int,
+    status: TaskStatus,
+    moment: datetime,
+    quantity: int,
+    count: int = 1,
+) -> None:
+    dialect_name = session.get_bind().dialect.name
+    await session.execute(upsert_stats_stmts[dialect_name], {
+        "stats_product_id": product_id,
+        "stats_status": status,
+        "stats_bucket": stats_bucket(moment, dialect_name),
+        "count_delta": count,
+        "quantity_delta": quantity,
+    })
+
+
+async def set_reservation_status(session: AsyncSession, reservation_id: int, status: TaskStatus) -> bool:
+    # Счётчики переносятся из старого статуса в новый в той же транзакции, commit за вызывающим
+    result = await session.execute(
+        select(ReservationsModel.product_id, ReservationsModel.quantity, ReservationsModel.status,
+               ReservationsModel.timestamp)
+        .where(ReservationsModel.reservation_id == reservation_id)
+        .with_for_update()
+    )
+    reservation = result.one_or_none()
+    if reservation is None:
+        return False
+    if reservation.status == status:
+        return True
+
+    await session.execute(
+        update(ReservationsModel).where(ReservationsModel.reservation_id == reservation_id).values(status=status)
+    )
+    # Строки счётчиков берутся в том же порядке, что и в reconcile, чтобы не было взаимных блокировок
+    changes = sorted([(reservation.status, -1), (status, 1)], key=lambda change: STATUS_ORDER[change[0]])
+    for changed_status, sign in changes:
+        await record_reservation_stats(
+            session, reservation.product_id, changed_status, reservation.timestamp,
+            sign * reservation.quantity, count=sign,
+        )
+    return True
+
+
+async def product_stats(
+    session: AsyncSession, product_id: int, start: date | None = None, end: date | None = None
+) -> list[ReservationStatsModel]:
+    query = select(ReservationStatsModel).where(ReservationStatsModel.product_id == product_id)
+    if start is not None:
+        query = query.where(ReservationStatsModel.bucket >= start)
+    if end is not None:
+        query = query.where(ReservationStatsModel.bucket <= end)
+    result = await session.execute(query.order_by(ReservationStatsModel.bucket, ReservationStatsModel.status))
+    return list(result.scalars())
+
+
+def stats_drift_query(dialect_name: str, since: date):
+    # Ожидаемые счётчики минус сохранённые одним запросом: оба слагаемых читаются из одного снимка,
+    # а дельта прибавляется к текущему значению, поэтому параллельные бронирования не теряются
+    bucket = bucket_expression(dialect_name)
+    expected = (
+        select(
+            ReservationsModel.product_id,
+            ReservationsModel.status,
+            bucket.label("bucket"),
+            func.count().label("count_delta"),
+            func.sum(ReservationsModel.quantity).label("quantity_delta"),
+        )
+        .where(ReservationsModel.timestamp >= datetime.combine(since, datetime.min.time(), timezone.utc))
+        .group_by(ReservationsModel.product_id, ReservationsModel.status, bucket)
+    )
+    stored = select(
+        ReservationStatsModel.product_id,
+        ReservationStatsModel.status,
+        ReservationStatsModel.bucket,
+        -ReservationStatsModel.reservations_count,
+        -ReservationStatsModel.quantity_total,
+    ).where(ReservationStatsModel.bucket >= since)
+    combined = union_all(expected, stored).subquery()
+
+    count_delta = func.sum(combined.c.count_delta)
+    quantity_delta = func.sum(combined.c.quantity_delta)
+    return (
+        select(combined.c.product_id, combined.c.status, combined.c.bucket, count_delta, quantity_delta)
+        .group_by(combined.c.product_id, combined.c.status, combined.c.bucket)
+        .having(or_(count_delta != 0, quantity_delta != 0))
+        .order_by(combined.c.product_id, combined.c.status, combined.c.bucket)
+    )
+
+
+async def reconcile_stats(session: AsyncSession, days: int = STATS_RECONCILE_DAYS) -> int:
+    # Проверяются только последние дни: старые брони могли уйти в архив вместе с партицией,
+    # а счётчики за них должны остаться
+    dialect_name = session.get_bind().dialect.name
+    since = datetime.now(timezone.utc).date() - timedelta(days=days)
+    if dialect_name == "postgresql":
+        # Две сверки с одного снимка прибавили бы одну и ту же дельту дважды. Вторая ждёт коммита первой
+        # и уже видит исправленные счётчики; блокировка снимается вместе с транзакцией
+        await session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": STATS_RECONCILE_LOCK_KEY})
+
+    result = await session.execute(stats_drift_query(dialect_name, since))
+    drift = [
+        {
+            "stats_product_id": product_id,
+            "stats_status": status,
+            "stats_bucket": bucket,
+            "count_delta": count_delta,
+            "quantity_delta": quantity_delta,
+        }
+        for product_id, status, bucket, count_delta, quantity_delta in result
+    ]
+    if drift:
+        await session.execute(upsert_stats_stmts[dialect_name], drift)
+        await session.execute(
+            delete(ReservationStatsModel).where(
+                ReservationStatsModel.bucket >= since,
+                ReservationStatsModel.reservations_count == 0,
+                ReservationStatsModel.quantity_total == 0,
+            )
+        )
+        logger.warning(f"Repaired {len(drift)} reservation stats buckets since {since}")
+    await session.commit()
+    return len(drift)
+
+
+async def reconcile_reservation_stats(session: AsyncSession, days: int = STATS_RECONCILE_DAYS) -> int:
+    if session.bind.dialect.name == "sqlite":
+        return await sqlite_writer.submit(session.bind, lambda write_session: reconcile_stats(write_session, days))
+    return await reconcile_stats(session, days)
+
+
+async def run_stats_reconciliation() -> None:
+    while True:
+        await asyncio.sleep(STATS_RECONCILE_INTERVAL_SECONDS)
+        try:
+            async with new_session() as session:
+                await reconcile_reservation_stats(session)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f"Reservation stats reconciliation failed: {e}")
@@ -0,0 +1,64 @@
+import os
+from collections import OrderedDict
+from typing import Any
+
+from app import notifications
+
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", "10000"))
+
+
+class ProductCache:
+    def __init__(self, max_size: int = PRODUCT_CACHE_SIZE):
+        self.max_size = max_size
+        self._items: OrderedDict[int, Any] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Часы инвалидаций: у каждого товара отметка последнего сброса, у clear() - общая
+        self._clock = 0
+        self._invalidated: dict[int, int] = {}
+        self._cleared = 0
+
+    def get(self, product_id: int) -> Any | None:
+        value = self._items.get(product_id)
+        if value is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(product_id)
+        self.hits += 1
+        return value
+
+    def generation(self) -> int:
+        return self._clock
+
+    def set(self, product_id: int, value: Any, generation: int | None = None) -> None:
+        # Значение, прочитанное до инвалидации этого товара, могло устареть. Изменения других товаров его не касаются
+        if self.max_size <= 0:
+            return
+        if generation is not None and max(self._cleared, self._invalidated.get(product_id, 0)) > generation:
+            return
+        self._items[product_id] = value
+        self._items.move_to_end(product_id)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def invalidate(self, product_id: int, available_quantity: int | None = None) -> None:
+        self._clock += 1
+        self._items.pop(product_id, None)
+        self._invalidated[product_id] = self._clock
+        if len(self._invalidated) > max(self.max_size, 1):
+            # Отметки не должны расти вместе с каталогом: общий сброс отменяет только начатые заполнения
+            self._cleared = self._clock
+            self._invalidated.clear()
+
+    def clear(self) -> None:
+        self._clock += 1
+        self._cleared = self._clock
+        self._invalidated.clear()
+        self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+product_cache = ProductCache()
+notifications.subscribe(product_cache.invalidate, on_reset=product_cache.clear)
@@ -0,0 +1,132 @@
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+from app.logger import logger
+
+CONTENTION_PROFILING = os.getenv("CONTENTION_PROFILING", "true").lower() == "true"
+CONTENTION_TOP_K = int(os.getenv("CONTENTION_TOP_K", "64"))
+CONTENTION_LOG_INTERVAL_SECONDS = int(os.getenv("CONTENTION_LOG_INTERVAL_SECONDS", "60"))
+CONTENTION_LOG_TOP = int(os.getenv("CONTENTION_LOG_TOP", "5"))
+
+
+@dataclass
+class ProductContention:
+    product_id: int
+    weight: float = 0.0
+    error: float = 0.0
+    reservations: int = 0
+    lock_wait_seconds: float = 0.0
+    lock_hold_seconds: float = 0.0
+    max_lock_wait_seconds: float = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "product_id": self.product_id,
+            "reservations": self.reservations,
+            "lock_wait_ms_total": round(self.lock_wait_seconds * 1000, 3),
+            "lock_wait_ms_avg": round(self.lock_wait_seconds * 1000 / self.reservations, 3) if self.reservations else 0,
+            "lock_wait_ms_max": round(self.max_lock_wait_seconds * 1000, 3),
+            "lock_hold_ms_total": round(self.lock_hold_seconds * 1000, 3),
+            "overestimate_ms": round(self.error * 1000, 3),
+        }
+
+
+class SpaceSaving:
+    # Взвешенный Space-Saving: не больше capacity счётчиков, вытесняется самый лёгкий,
+    # а новый ключ наследует его вес как верхнюю оценку ошибки
+    def __init__(self, capacity: int = CONTENTION_TOP_K):
+        self.capacity = capacity
+        self._items: dict[int, ProductContention] = {}
+
+    def add(self, product_id: int, weight: float) -> ProductContention:
+        item = self._items.get(product_id)
+        if item is None:
+            if len(self._items) < self.capacity:
+                item = ProductContention(product_id)
+            else:
+                evicted = min(self._items.values(), key=lambda entry: entry.weight)
+                del self._items[evicted.product_id]
+                item = ProductContention(product_id, weight=evicted.weight, error=evicted.weight)
+            self._items[product_id] = item
+        item.weight += weight
+        return item
+
+    def top(self, limit: int | None = None) -> list[ProductContention]:
+        items = sorted(self._items.values(), key=lambda entry: entry.weight, reverse=True)
+        return items[:limit] if limit is not None else items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+@dataclass
+class ContentionWindow:
+    started_at: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    heavy_hitters: SpaceSaving = field(default_factory=SpaceSaving)
+
+
+class ContentionProfiler:
+    def __init__(self, enabled: bool = CONTENTION_PROFILING):
+        self.enabled = enabled
+        self.current = ContentionWindow()
+        self.previous: ContentionWindow | None = None
+
+    def record(self, product_id: int, lock_wait: float, lock_hold: float) -> None:
+        if not self.enabled:
+            return
+        # Вес товара - суммарное время, которое запросы провели в ожидании и удержании его блокировки
+        item = self.current.heavy_hitters.add(product_id, lock_wait + lock_hold)
+        item.reservations += 1
+        item.lock_wait_seconds += lock_wait
+        item.lock_hold_seconds += lock_hold
+        item.max_lock_wait_seconds = max(item.max_lock_wait_seconds, lock_wait)
+
+    def rotate(self) -> ContentionWindow:
+        self.previous, self.current = self.current, ContentionWindow()
+        return self.previous
+
+    def report(self, limit: int | None = None) -> dict:
+        def window(data: ContentionWindow | None) -> dict | None:
+            if data is None:
+                return None
+            return {
+                "started_at": data.started_at.isoformat(),
+                "products": [item.as_dict() for item in data.heavy_hitters.top(limit)],
+            }
+
+        return {"enabled": self.enabled, "current": window(self.current), "previous": window(self.previous)}
+
+
+class LockTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.acquired = self.started
+
+    def lock_acquired(self) -> None:
+        self.acquired = time.perf_counter()
+
+    def record(self, product_id: int) -> None:
+        released = time.perf_counter()
+        contention_profiler.record(product_id, self.acquired - self.started, released - self.acquired)
+
+
+contention_profiler = ContentionProfiler()
+
+
+async def log_contention_summaries(interval: int = CONTENTION_LOG_INTERVAL_SECONDS) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        window = contention_profiler.rotate()
+        top = window.heavy_hitters.top(CONTENTION_LOG_TOP)
+        if not top:
+            continue
+        summary = ", ".join(
+            f"{item.product_id}: {item.reservations} reservations, "
+            f"wait {item.lock_wait_seconds * 1000:.1f} ms (max {item.max_lock_wait_seconds * 1000:.1f} ms), "
+            f"hold {item.lock_hold_seconds * 1000:.1f} ms"
+            for item in top
+        )
+        logger.info(f"Most contended products in the last {interval}s: {summary}")
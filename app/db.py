@@ -1,6 +1,8 @@
 from typing import Any, AsyncGenerator
 
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
 import os
 from dotenv import load_dotenv
@@ -11,7 +13,53 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is not set. Please check your .env file.")
 
-engine = create_async_engine(DATABASE_URL)
+# uvicorn читает WEB_CONCURRENCY сам, поэтому число воркеров и размер пула берутся из одной переменной
+WEB_CONCURRENCY = max(1, int(os.getenv("WEB_CONCURRENCY", "1")))
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "20"))
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "5"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+
+def worker_pool_size(max_connections: int = DB_MAX_CONNECTIONS, workers: int = WEB_CONCURRENCY) -> int:
+    # Одно соединение на воркер занимает LISTEN-слушатель из app/notifications.py
+    if workers * 2 > max_connections:
+        raise ValueError(
+            f"DB_MAX_CONNECTIONS={max_connections} is too small for WEB_CONCURRENCY={workers}: "
+            f"each worker needs a pool connection and a LISTEN connection"
+        )
+    return max_connections // workers - 1
+
+
+def is_postgres(url: str = DATABASE_URL) -> bool:
+    return make_url(url).get_backend_name() == "postgresql"
+
+
+def is_sqlite_file(url: str = DATABASE_URL) -> bool:
+    parsed = make_url(url)
+    return parsed.get_backend_name() == "sqlite" and parsed.database not in (None, "", ":memory:")
+
+
+def configure_sqlite(target: AsyncEngine) -> None:
+    # WAL даёт параллельных читателей рядом с единственным писателем из app/writer.py
+    @event.listens_for(target.sync_engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+
+engine_options: dict[str, Any] = {}
+if is_postgres():
+    engine_options.update(pool_size=worker_pool_size(), max_overflow=0, pool_pre_ping=True)
+elif is_sqlite_file():
+    engine_options.update(pool_size=SQLITE_POOL_SIZE, max_overflow=0)
+
+engine = create_async_engine(DATABASE_URL, **engine_options)
+if is_sqlite_file():
+    configure_sqlite(engine)
 new_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
@@ -25,4 +73,4 @@ async def set_db() -> None:
         await conn.run_sync(Base.metadata.create_all)
 
 
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
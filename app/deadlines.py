@@ -0,0 +1,151 @@
+import asyncio
+import os
+import time
+from typing import Awaitable, TypeVar
+
+from fastapi import HTTPException, Request, status
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.logger import logger
+from app.schema import ResponseType
+
+REQUEST_TIMEOUT_HEADER = "X-Request-Timeout-Ms"
+REQUEST_TIMEOUT_MS = int(os.getenv("REQUEST_TIMEOUT_MS", "5000"))
+MAX_REQUEST_TIMEOUT_MS = int(os.getenv("MAX_REQUEST_TIMEOUT_MS", "30000"))
+DEADLINE_COMMIT_GRACE_MS = int(os.getenv("DEADLINE_COMMIT_GRACE_MS", "5000"))
+DISCONNECT_POLL_SECONDS = 0.1
+
+# lock_not_available и query_canceled: сработали lock_timeout или statement_timeout
+TIMEOUT_SQLSTATES = {"55P03", "57014"}
+# Статус nginx для запроса, который клиент бросил до ответа
+CLIENT_CLOSED_REQUEST = 499
+# Машиночитаемый код ответа 504: повторять можно только timeout
+CODE_TIMEOUT = "timeout"
+CODE_OUTCOME_UNKNOWN = "outcome_unknown"
+
+set_timeouts_stmt = text(
+    "SELECT set_config('lock_timeout', :lock_timeout, true), "
+    "set_config('statement_timeout', :statement_timeout, true)"
+)
+
+T = TypeVar("T")
+
+
+class Deadline:
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout
+        # Выставляется перед commit или передачей брони леджеру: после этого отмена уже не откатит списание
+        self.committing = False
+
+    def start_commit(self) -> None:
+        self.committing = True
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def remaining_ms(self) -> int:
+        # 0 в Postgres выключает таймаут, поэтому истёкший срок округляется до 1 мс
+        return max(int(self.remaining() * 1000), 1)
+
+
+def request_deadline(request: Request) -> Deadline:
+    timeout_ms = REQUEST_TIMEOUT_MS
+    header = request.headers.get(REQUEST_TIMEOUT_HEADER)
+    if header is not None:
+        try:
+            timeout_ms = min(max(int(header), 1), MAX_REQUEST_TIMEOUT_MS)
+        except ValueError:
+            logger.warning(f"Ignoring malformed {REQUEST_TIMEOUT_HEADER} header: {header!r}")
+    return Deadline(timeout_ms / 1000)
+
+
+async def apply_db_timeouts(session: AsyncSession, deadline: Deadline | None) -> None:
+    # set_config(..., true) действует до конца текущей транзакции, как SET LOCAL
+    if deadline is None or session.get_bind().dialect.name != "postgresql":
+        return
+    remaining = f"{deadline.remaining_ms()}ms"
+    await session.execute(set_timeouts_stmt, {"lock_timeout": remaining, "statement_timeout": remaining})
+
+
+def is_timeout_error(error: DBAPIError) -> bool:
+    return getattr(error.orig, "sqlstate", None) in TIMEOUT_SQLSTATES
+
+
+def timed_out() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        detail={
+            "status": ResponseType.error.value,
+            "message": "Reservation timed out, retry later.",
+            "code": CODE_TIMEOUT,
+            "reservation_id": None
+        }
+    )
+
+
+def outcome_unknown() -> HTTPException:
+    # Бронь могла пройти, повтор может списать остаток второй раз
+    return HTTPException(
+        status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+        detail={
+            "status": ResponseType.error.value,
+            "message": "Reservation outcome unknown, check stock before retrying.",
+            "code": CODE_OUTCOME_UNKNOWN,
+            "reservation_id": None
+        }
+    )
+
+
+def client_disconnected() -> HTTPException:
+    return HTTPException(
+        status_code=CLIENT_CLOSED_REQUEST,
+        detail={
+            "status": ResponseType.error.value,
+            "message": "Client closed request.",
+            "reservation_id": None
+        }
+    )
+
+
+_committing_tasks: set[asyncio.Task] = set()
+
+
+async def wait_for_outcome(task: asyncio.Task) -> T:
+    done, _ = await asyncio.wait({task}, timeout=DEADLINE_COMMIT_GRACE_MS / 1000)
+    if done:
+        return task.result()
+    logger.error("Reservation commit outlived the grace period, outcome unknown")
+    raise outcome_unknown()
+
+
+async def run_until_deadline(request: Request, deadline: Deadline, work: Awaitable[T]) -> T:
+    # Отмена задачи отменяет и текущий запрос к базе: asyncpg отправляет серверу cancel.
+    # Начатый commit не отменяется: вместо "повторите" клиент получает исход брони
+    task = asyncio.ensure_future(work)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=min(DISCONNECT_POLL_SECONDS, deadline.remaining()))
+            if done:
+                return task.result()
+            expired = deadline.remaining() <= 0
+            if not expired and not await request.is_disconnected():
+                continue
+            if deadline.committing:
+                logger.warning("Reservation deadline passed during commit, waiting for the outcome")
+                return await wait_for_outcome(task)
+            if expired:
+                logger.warning("Reservation deadline exceeded, cancelling")
+                raise timed_out()
+            logger.warning("Client disconnected, cancelling reservation")
+            raise client_disconnected()
+    finally:
+        if not task.done() and deadline.committing:
+            # Досчитывается в фоне, ссылка не даёт сборщику мусора удалить задачу
+            _committing_tasks.add(task)
+            task.add_done_callback(_committing_tasks.discard)
+        elif not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
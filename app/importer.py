@@ -0,0 +1,274 @@
+import argparse
+import asyncio
+import codecs
+import csv
+import os
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable
+
+from sqlalchemy import bindparam, exists, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.logger import logger
+from app.models import LedgerLeasesModel, ProductsModel
+from app.notifications import notify_stock_changes
+from app.schema import ImportMode, ImportSummary
+from app.writer import sqlite_writer
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "1000"))
+IMPORT_MAX_ERRORS = 20
+# available_quantity в Postgres — INTEGER
+MAX_QUANTITY = 2**31 - 1
+READ_BLOCK_SIZE = 64 * 1024
+
+REQUIRED_COLUMNS = ("product_name", "quantity")
+
+products_table = ProductsModel.__table__
+
+
+@dataclass
+class ImportStats:
+    rows_total: int = 0
+    products_updated: int = 0
+    products_created: int = 0
+    rows_rejected: int = 0
+    errors: list[str] = field(default_factory=list)
+    started: float = field(default_factory=time.perf_counter)
+
+    def reject(self, line: int, reason: str) -> None:
+        self.rows_rejected += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append(f"line {line}: {reason}")
+
+    def reject_product(self, name: str, reason: str) -> None:
+        self.rows_rejected += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append(f"product {name!r}: {reason}")
+
+    def summary(self) -> ImportSummary:
+        seconds = time.perf_counter() - self.started
+        return ImportSummary(
+            rows_total=self.rows_total,
+            products_updated=self.products_updated,
+            products_created=self.products_created,
+            rows_rejected=self.rows_rejected,
+            seconds=round(seconds, 3),
+            rows_per_second=round(self.rows_total / seconds, 1) if seconds else 0.0,
+            errors=self.errors,
+        )
+
+
+class RecordAssembler:
+    # Запись CSV может занимать несколько строк, пока кавычки в ней не закрыты
+    def __init__(self):
+        self.line_number = 0
+        self.record: str | None = None
+        self.record_line = 0
+
+    def feed(self, line: str) -> tuple[int, list[str]] | None:
+        self.line_number += 1
+        line = line.rstrip("\r")
+        if self.record is None:
+            self.record, self.record_line = line, self.line_number
+        else:
+            self.record += "\n" + line
+        if self.record.count('"') % 2:
+            return None
+        return self.finish()
+
+    def finish(self) -> tuple[int, list[str]] | None:
+        record, self.record = self.record, None
+        if record is None or not record.strip():
+            return None
+        return self.record_line, next(csv.reader([record]))
+
+
+async def iter_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[tuple[int, list[str]]]:
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    assembler = RecordAssembler()
+    buffer = ""
+
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            if (record := assembler.feed(line)) is not None:
+                yield record
+
+    buffer += decoder.decode(b"", final=True)
+    if buffer and (record := assembler.feed(buffer)) is not None:
+        yield record
+    if (record := assembler.finish()) is not None:
+        yield record
+
+
+async def read_file(path: str) -> AsyncIterator[bytes]:
+    with open(path, "rb") as source:
+        while block := source.read(READ_BLOCK_SIZE):
+            yield block
+
+
+def parse_row(header: dict[str, int], values: list[str]) -> tuple[str, int]:
+    name = values[header["product_name"]].strip() if len(values) > header["product_name"] else ""
+    if not name:
+        raise ValueError("empty product_name")
+    raw_quantity = values[header["quantity"]].strip() if len(values) > header["quantity"] else ""
+    try:
+        quantity = int(raw_quantity)
+    except ValueError:
+        raise ValueError(f"quantity {raw_quantity!r} is not an integer")
+    if quantity < 0:
+        raise ValueError("quantity must not be negative")
+    if quantity > MAX_QUANTITY:
+        raise ValueError(f"quantity must not exceed {MAX_QUANTITY}")
+    return name, quantity
+
+
+def _upsert_stock_stmt(insert, mode: ImportMode):
+    stmt = insert(products_table).values(
+        product_name=bindparam("import_name"),
+        available_quantity=bindparam("import_quantity"),
+    )
+    new_quantity = stmt.excluded.available_quantity
+    where = None
+    if mode == ImportMode.add:
+        new_quantity = products_table.c.available_quantity + new_quantity
+    else:
+        # Остаток арендованного товара живёт в леджере, а в products лежит ноль: перезапись сложилась бы
+        # с возвращённой арендой. Добавка безопасна, её забирает повторная аренда или вернёт release
+        where = ~exists().where(LedgerLeasesModel.product_id == products_table.c.product_id)
+    return stmt.on_conflict_do_update(
+        index_elements=[products_table.c.product_name],
+        set_={"available_quantity": new_quantity},
+        where=where,
+    ).returning(products_table.c.product_id, products_table.c.product_name, products_table.c.available_quantity)
+
+
+# Товар, который параллельный импорт создал между чтением и вставкой, просто обновляется, а не роняет чанк
+upsert_stock_stmts = {
+    (dialect_name, mode): _upsert_stock_stmt(insert, mode)
+    for dialect_name, insert in (("postgresql", postgresql.insert), ("sqlite", sqlite.insert))
+    for mode in ImportMode
+}
+
+
+async def apply_chunk(session: AsyncSession, rows: dict[str, int], mode: ImportMode) -> tuple[int, int, list[str]]:
+    # Строки вставляются в порядке product_name, поэтому параллельные импорты блокируют товары
+    # в одном порядке и не ждут друг друга по кругу, а reserve() держит только одну строку
+    result = await session.execute(select(ProductsModel.product_name).where(ProductsModel.product_name.in_(rows)))
+    # Счётчики ответа по снимку до вставки: товар, созданный параллельным импортом, может попасть в созданные дважды
+    existing = set(result.scalars())
+
+    result = await session.execute(
+        upsert_stock_stmts[(session.get_bind().dialect.name, mode)],
+        [{"import_name": name, "import_quantity": rows[name]} for name in sorted(rows)],
+    )
+    changed = {name: (product_id, quantity) for product_id, name, quantity in result}
+    await notify_stock_changes(session, list(changed.values()))
+    await session.commit()
+    leased = sorted(name for name in rows if name not in changed)
+    return len(existing) - len(leased), len(rows) - len(existing), leased
+
+
+async def import_products(
+    session: AsyncSession,
+    chunks: AsyncIterator[bytes],
+    mode: ImportMode = ImportMode.add,
+    chunk_size: int = IMPORT_CHUNK_SIZE,
+) -> ImportSummary:
+    stats = ImportStats()
+    header: dict[str, int] | None = None
+    pending: dict[str, int] = {}
+
+    if session.bind.dialect.name == "sqlite":
+        # В SQLite остатки меняет только последовательный писатель
+        def run(rows: dict[str, int]) -> Awaitable[tuple[int, int, list[str]]]:
+            return sqlite_writer.submit(session.bind, lambda write_session: apply_chunk(write_session, rows, mode))
+    else:
+        async def run(rows: dict[str, int]) -> tuple[int, int, list[str]]:
+            try:
+                return await apply_chunk(session, rows, mode)
+            except DBAPIError:
+                await session.rollback()
+                raise
+
+    async def flush() -> None:
+        nonlocal pending
+        if not pending:
+            return
+        rows, pending = pending, {}
+        try:
+            results = [await run(rows)]
+        except DBAPIError as e:
+            if e.connection_invalidated:
+                raise
+            # Чанк откатился целиком, например сумма add вышла за INTEGER у одного товара.
+            # Повторяем по одному товару, чтобы отклонить только виноватые
+            logger.warning(f"Import chunk of {len(rows)} products failed ({e.orig!r}), retrying product by product")
+            results = []
+            for name in sorted(rows):
+                try:
+                    results.append(await run({name: rows[name]}))
+                except DBAPIError as row_error:
+                    if row_error.connection_invalidated:
+                        raise
+                    stats.reject_product(name, f"rejected by the database: {str(row_error.orig).splitlines()[0]}")
+        for updated, created, leased in results:
+            stats.products_updated += updated
+            stats.products_created += created
+            for name in leased:
+                stats.reject_product(name, "stock is leased by the inventory ledger, release it before mode=set")
+
+    async for line, values in iter_records(chunks):
+        if header is None:
+            header = {name.strip(): index for index, name in enumerate(values)}
+            missing = [column for column in REQUIRED_COLUMNS if column not in header]
+            if missing:
+                raise ValueError(f"CSV header is missing columns: {', '.join(missing)}")
+            continue
+
+        stats.rows_total += 1
+        try:
+            name, quantity = parse_row(header, values)
+        except ValueError as e:
+            stats.reject(line, str(e))
+            continue
+
+        # Повторы товара внутри чанка складываются (add) или последний побеждает (set)
+        if mode == ImportMode.add:
+            quantity += pending.get(name, 0)
+            if quantity > MAX_QUANTITY:
+                stats.reject(line, f"total quantity for {name!r} exceeds {MAX_QUANTITY}")
+                continue
+        pending[name] = quantity
+        if len(pending) >= chunk_size:
+            await flush()
+
+    await flush()
+    summary = stats.summary()
+    logger.info(
+        f"Stock import finished: {summary.products_updated} updated, {summary.products_created} created, "
+        f"{summary.rows_rejected} rejected, {summary.rows_per_second} rows/s"
+    )
+    return summary
+
+
+async def main(path: str, mode: ImportMode, chunk_size: int) -> None:
+    from app.db import engine, new_session
+
+    async with new_session() as session:
+        summary = await import_products(session, read_file(path), mode, chunk_size)
+    print(summary.model_dump_json(indent=2))
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import stock replenishment from CSV (product_name,quantity)")
+    parser.add_argument("path")
+    parser.add_argument("--mode", choices=[mode.value for mode in ImportMode], default=ImportMode.add.value)
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    options = parser.parse_args()
+    asyncio.run(main(options.path, ImportMode(options.mode), options.chunk_size))
@@ -0,0 +1,501 @@
+import asyncio
+import json
+import os
+from abc import ABC, abstractmethod
+from collections import defaultdict, deque
+from datetime import datetime
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy import bindparam, insert, select, text, update
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from app import metrics
+from app.aggregates import stats_bucket, upsert_stats_stmts
+from app.db import WEB_CONCURRENCY
+from app.logger import logger
+from app.models import LedgerLeasesModel, ProductsModel, ReservationsModel, TaskStatus
+from app.notifications import dispatch, notify_stock_change
+from app.partitions import RESERVATIONS_PARTITIONING, encode_reservation_id
+from app.writer import sqlite_writer
+
+INVENTORY_LEDGER = os.getenv("INVENTORY_LEDGER", "false").lower() == "true"
+LEDGER_PRODUCTS = [int(product_id) for product_id in os.getenv("LEDGER_PRODUCTS", "").split(",") if product_id.strip()]
+LEDGER_JOURNAL_DIR = os.getenv("LEDGER_JOURNAL_DIR", "ledger-journal")
+LEDGER_FLUSH_INTERVAL_MS = int(os.getenv("LEDGER_FLUSH_INTERVAL_MS", "50"))
+LEDGER_ID_BLOCK_SIZE = int(os.getenv("LEDGER_ID_BLOCK_SIZE", "1000"))
+RECOVERY_CHUNK_SIZE = 1000
+
+if INVENTORY_LEDGER and WEB_CONCURRENCY > 1:
+    # Остаток арендованных товаров живёт в памяти одного процесса, второй владелец продал бы его повторно
+    raise ValueError("INVENTORY_LEDGER requires a single worker (WEB_CONCURRENCY=1)")
+
+
+class NotLeased(Exception):
+    pass
+
+
+class IdAllocator(ABC):
+    # Выдаёт блок значений последовательности reservation_id, пока леджер раздаёт их из памяти
+    @abstractmethod
+    async def allocate(self, session: AsyncSession, count: int) -> list[int]:
+        ...
+
+
+class SequenceIdAllocator(IdAllocator):
+    def __init__(self, sequence: str = "reservations_reservation_id_seq"):
+        self.stmt = text(f"SELECT nextval('{sequence}') FROM generate_series(1, :count)")
+
+    async def allocate(self, session: AsyncSession, count: int) -> list[int]:
+        result = await session.execute(self.stmt, {"count": count})
+        return list(result.scalars())
+
+
+class SqliteIdAllocator(IdAllocator):
+    # Сдвигаем счётчик AUTOINCREMENT: обычные вставки получат id после выданного блока
+    init_stmt = text(
+        "INSERT INTO sqlite_sequence (name, seq) "
+        "SELECT 'reservations', coalesce((SELECT max(reservation_id) FROM reservations), 0) "
+        "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'reservations')"
+    )
+    bump_stmt = text("UPDATE sqlite_sequence SET seq = seq + :count WHERE name = 'reservations' RETURNING seq")
+
+    async def allocate(self, session: AsyncSession, count: int) -> list[int]:
+        await session.execute(self.init_stmt)
+        last = (await session.execute(self.bump_stmt, {"count": count})).scalar_one()
+        await session.commit()
+        return list(range(last - count + 1, last + 1))
+
+
+def id_allocator_for(bind: AsyncEngine) -> IdAllocator:
+    return SqliteIdAllocator() if bind.dialect.name == "sqlite" else SequenceIdAllocator()
+
+
+# Вызывается синхронно после записи группы (None) или её ошибки: к возврату из rotate() результат уже учтён
+WriteCallback = Callable[[BaseException | None], None]
+
+
+class Journal:
+    # Журнал - сегменты JSON-строк. Записи копятся в буфере и пишутся одной группой с одним fsync,
+    # сегмент удаляется после того, как все его записи закоммичены в базу
+    def __init__(self, directory: str = LEDGER_JOURNAL_DIR):
+        self.directory = directory
+        self._file = None
+        self._segment = 0
+        self._new_segment = False
+        self._buffer: list[tuple[str, asyncio.Future, WriteCallback | None]] = []
+        self._wakeup: asyncio.Event | None = None
+        self._lock: asyncio.Lock | None = None
+        self._task: asyncio.Task | None = None
+        self._closing = False
+
+    @property
+    def is_open(self) -> bool:
+        return self._task is not None
+
+    def segments(self) -> list[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(".journal"))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def read(self) -> list[dict]:
+        records = []
+        for path in self.segments():
+            with open(path, "rb") as segment:
+                for number, line in enumerate(segment, 1):
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # Недописанная при падении строка: клиент не получил подтверждения
+                        logger.warning(f"Skipping torn ledger journal record {path}:{number}")
+        return records
+
+    def open(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        existing = [int(os.path.basename(path).split(".")[0]) for path in self.segments()]
+        self._segment = max(existing, default=0)
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._closing = False
+        self._open_next_segment()
+        self._task = asyncio.create_task(self._run())
+
+    def _open_next_segment(self) -> None:
+        self._segment += 1
+        self._file = open(os.path.join(self.directory, f"{self._segment:012d}.journal"), "ab")
+        self._new_segment = True
+
+    def append(self, record: dict, on_written: WriteCallback | None = None) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._buffer.append((json.dumps(record, separators=(",", ":")) + "\n", future, on_written))
+        self._wakeup.set()
+        return future
+
+    def _sync_write(self, data: bytes, sync_directory: bool) -> None:
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        if sync_directory:
+            directory = os.open(self.directory, os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+
+    async def _write_buffer(self) -> None:
+        if not self._buffer:
+            return
+        group, self._buffer = self._buffer, []
+        sync_directory, self._new_segment = self._new_segment, False
+        try:
+            await asyncio.to_thread(self._sync_write, "".join(line for line, _, _ in group).encode(), sync_directory)
+        except Exception as e:
+            logger.error(f"Ledger journal write failed: {e}")
+            for _, future, on_written in group:
+                if on_written is not None:
+                    on_written(e)
+                if not future.done():
+                    future.set_exception(e)
+            return
+        metrics.inc("ledger.journal_groups")
+        for _, future, on_written in group:
+            if on_written is not None:
+                on_written(None)
+            if not future.done():
+                future.set_result(None)
+
+    async def _run(self) -> None:
+        # Пока идёт fsync, новые записи копятся в буфере и уходят следующей группой
+        while not self._closing:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            async with self._lock:
+                await self._write_buffer()
+
+    async def rotate(self) -> str:
+        # Между заменой файла и возвратом управления вызывающему нет ни одной точки переключения,
+        # поэтому всё, что попало в закрытый сегмент, уже лежит в его снимке ожидающих записей
+        async with self._lock:
+            await self._write_buffer()
+            closed = self._file.name
+            self._file.close()
+            self._open_next_segment()
+        return closed
+
+    @staticmethod
+    def remove(paths: list[str]) -> None:
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        # Задачу не отменяем: fsync в потоке всё равно допишет группу, а её ожидающие остались бы без ответа
+        self._closing = True
+        self._wakeup.set()
+        await self._task
+        self._task = None
+        async with self._lock:
+            await self._write_buffer()
+            self._file.close()
+
+
+async def apply_batch(session: AsyncSession, records: list[dict]) -> None:
+    # Брони, списание аренды и счётчики статистики пишутся одной транзакцией
+    dialect_name = session.get_bind().dialect.name
+    rows = []
+    reserved: dict[int, int] = defaultdict(int)
+    stats: dict[tuple[int, Any], list[int]] = defaultdict(lambda: [0, 0])
+    for record in records:
+        moment = datetime.fromisoformat(record["timestamp"])
+        rows.append({
+            "reservation_id": record["reservation_id"],
+            "product_id": record["product_id"],
+            "quantity": record["quantity"],
+            "status": TaskStatus.completed,
+            "timestamp": moment,
+        })
+        reserved[record["product_id"]] += record["quantity"]
+        bucket = stats[(record["product_id"], stats_bucket(moment, dialect_name))]
+        bucket[0] += 1
+        bucket[1] += record["quantity"]
+
+    await session.execute(insert(ReservationsModel), rows)
+    await session.execute(
+        update(LedgerLeasesModel.__table__)
+        .where(LedgerLeasesModel.__table__.c.product_id == bindparam("lease_product_id"))
+        .values(quantity=LedgerLeasesModel.__table__.c.quantity - bindparam("reserved_units")),
+        [{"lease_product_id": product_id, "reserved_units": units} for product_id, units in sorted(reserved.items())],
+    )
+    await session.execute(upsert_stats_stmts[dialect_name], [
+        {
+            "stats_product_id": product_id,
+            "stats_status": TaskStatus.completed,
+            "stats_bucket": bucket,
+            "count_delta": count,
+            "quantity_delta": quantity,
+        }
+        for (product_id, bucket), (count, quantity) in sorted(stats.items())
+    ])
+    await session.commit()
+
+
+async def take_stock(session: AsyncSession, product_id: int) -> int | None:
+    result = await session.execute(
+        select(ProductsModel.available_quantity).where(ProductsModel.product_id == product_id).with_for_update()
+    )
+    available_quantity = result.scalar_one_or_none()
+    if available_quantity is None:
+        return None
+    await session.execute(
+        update(ProductsModel).where(ProductsModel.product_id == product_id).values(available_quantity=0)
+    )
+    lease = await session.get(LedgerLeasesModel, product_id, with_for_update=True)
+    if lease is None:
+        session.add(LedgerLeasesModel(product_id=product_id, quantity=available_quantity))
+    else:
+        lease.quantity += available_quantity
+    # В products теперь ноль, но продаётся остаток леджера: подписчикам его раздаёт lease(), здесь только сброс кэша
+    await notify_stock_change(session, product_id, None)
+    await session.commit()
+    return available_quantity
+
+
+async def return_stock(session: AsyncSession, product_id: int) -> int:
+    lease = await session.get(LedgerLeasesModel, product_id, with_for_update=True)
+    if lease is None:
+        return 0
+    returned = lease.quantity
+    result = await session.execute(
+        update(ProductsModel)
+        .where(ProductsModel.product_id == product_id)
+        .values(available_quantity=ProductsModel.available_quantity + returned)
+        .returning(ProductsModel.available_quantity)
+    )
+    await session.delete(lease)
+    await notify_stock_change(session, product_id, result.scalar_one())
+    await session.commit()
+    return returned
+
+
+class InventoryLedger:
+    # Остаток арендованных товаров решается в памяти, а в базу пишется пачками с отставанием.
+    # Бронь подтверждается клиенту после fsync журнала, поэтому падение процесса её не теряет
+    def __init__(
+        self,
+        journal_dir: str = LEDGER_JOURNAL_DIR,
+        flush_interval: float = LEDGER_FLUSH_INTERVAL_MS / 1000,
+        id_block_size: int = LEDGER_ID_BLOCK_SIZE,
+        allocator: IdAllocator | None = None,
+    ):
+        self.journal = Journal(journal_dir)
+        self.flush_interval = flush_interval
+        self.id_block_size = id_block_size
+        self.allocator = allocator
+        self.bind: AsyncEngine | None = None
+        self.remaining: dict[int, int] = {}
+        self.pending: dict[int, dict] = {}
+        self._returned: set[int] = set()
+        self._ids: deque[int] = deque()
+        self._refill: asyncio.Task | None = None
+        self._flush_lock: asyncio.Lock | None = None
+        self._closed_segments: list[str] = []
+        self._task: asyncio.Task | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def owns(self, product_id: int) -> bool:
+        return product_id in self.remaining
+
+    def available(self, product_id: int) -> int | None:
+        return self.remaining.get(product_id)
+
+    def is_pending(self, reservation_id: int) -> bool:
+        return reservation_id in self.pending
+
+    async def _write(self, job: Callable[[AsyncSession], Awaitable[Any]]) -> Any:
+        if self.bind.dialect.name == "sqlite":
+            return await sqlite_writer.submit(self.bind, job)
+        async with AsyncSession(self.bind, expire_on_commit=False) as session:
+            return await job(session)
+
+    async def start(self, bind: AsyncEngine) -> None:
+        self.bind = bind
+        self.allocator = self.allocator or id_allocator_for(bind)
+        self._flush_lock = asyncio.Lock()
+        await self.recover()
+
+        async with AsyncSession(bind) as session:
+            result = await session.execute(select(LedgerLeasesModel.product_id, LedgerLeasesModel.quantity))
+            self.remaining = {product_id: quantity for product_id, quantity in result}
+
+        self.journal.open()
+        self._task = asyncio.create_task(self._run_write_behind())
+        logger.info(f"Inventory ledger started with {len(self.remaining)} leased products")
+
+    async def recover(self) -> int:
+        # Повтор журнала идемпотентен: брони, которые успели попасть в базу, пропускаются
+        segments = self.journal.segments()
+        records = {record["reservation_id"]: record for record in self.journal.read()}
+        ids = list(records)
+        replayed = 0
+        for start in range(0, len(ids), RECOVERY_CHUNK_SIZE):
+            chunk = ids[start:start + RECOVERY_CHUNK_SIZE]
+            async with AsyncSession(self.bind) as session:
+                result = await session.execute(
+                    select(ReservationsModel.reservation_id).where(ReservationsModel.reservation_id.in_(chunk))
+                )
+                written = set(result.scalars())
+            missing = [records[reservation_id] for reservation_id in chunk if reservation_id not in written]
+            if missing:
+                await self._write(lambda session: apply_batch(session, missing))
+                replayed += len(missing)
+        self.journal.remove(segments)
+        if records:
+            logger.warning(f"Ledger journal recovery: {replayed} of {len(records)} reservations replayed")
+        return replayed
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        # Под блокировкой сброса фоновая задача не пишет в базу и её можно отменить без обрыва транзакции
+        async with self._flush_lock:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        if self._refill is not None:
+            await asyncio.gather(self._refill, return_exceptions=True)
+            self._refill = None
+        await self.journal.close()
+        try:
+            await self.flush()
+        except Exception as e:
+            # Записи остались в журнале и будут повторены при следующем запуске
+            logger.error(f"Ledger flush on shutdown failed: {e}")
+            return
+        self.journal.remove(self.journal.segments())
+
+    async def lease(self, product_id: int) -> int | None:
+        # Повторная аренда добирает остаток, появившийся в products, например после поставки
+        leased = await self._write(lambda session: take_stock(session, product_id))
+        if leased is None:
+            return None
+        self._returned.discard(product_id)
+        self.remaining[product_id] = self.remaining.get(product_id, 0) + leased
+        dispatch(product_id, self.remaining[product_id])
+        logger.info(f"Leased {leased} units of product {product_id} into the inventory ledger")
+        return leased
+
+    async def release(self, product_id: int) -> int:
+        # Новые брони сразу уходят в базу, неиспользованный остаток возвращается после записи хвоста.
+        # Журнал поворачивается даже без ожидающих записей: так дожидаемся группы, которая сейчас в fsync,
+        # иначе её бронь попала бы в pending уже после возврата всей аренды
+        self.remaining.pop(product_id, None)
+        await self.flush(rotate=True)
+        self._returned.add(product_id)
+        returned = await self._write(lambda session: return_stock(session, product_id))
+        logger.info(f"Returned {returned} unused units of product {product_id} from the inventory ledger")
+        return returned
+
+    async def _allocate_ids(self) -> None:
+        ids = await self._write(lambda session: self.allocator.allocate(session, self.id_block_size))
+        self._ids.extend(ids)
+
+    async def _next_id(self) -> int:
+        # Следующий блок запрашивается заранее, на горячем пути ожидание бывает только при пустом запасе
+        if len(self._ids) < self.id_block_size // 2 and (self._refill is None or self._refill.done()):
+            self._refill = asyncio.create_task(self._allocate_ids())
+        while not self._ids:
+            if self._refill.done():
+                self._refill = asyncio.create_task(self._allocate_ids())
+            await asyncio.shield(self._refill)
+        return self._ids.popleft()
+
+    async def reserve(
+        self, product_id: int, quantity: int, moment: datetime, on_commit: Callable[[], None] | None = None
+    ) -> int | None:
+        reservation_id = await self._next_id()
+        if RESERVATIONS_PARTITIONING:
+            reservation_id = encode_reservation_id(moment, reservation_id)
+
+        remaining = self.remaining.get(product_id)
+        if remaining is None:
+            raise NotLeased(product_id)
+        if remaining < quantity:
+            return None
+        if on_commit is not None:
+            on_commit()
+        self.remaining[product_id] = remaining - quantity
+
+        record = {
+            "reservation_id": reservation_id,
+            "product_id": product_id,
+            "quantity": quantity,
+            "timestamp": moment.isoformat(),
+        }
+
+        refused = False
+
+        def on_written(error: BaseException | None) -> None:
+            # В запись в базу попадают только брони, уже лежащие в журнале. Если журнал не записался,
+            # остаток возвращается, и бронь не появится ни в базе, ни в ответе
+            nonlocal refused
+            if error is None and product_id in self._returned:
+                # Аренда уже вернулась в products: бронь из неё продала бы остаток второй раз
+                refused = True
+                logger.error(f"Ledger reservation {reservation_id} written after product {product_id} was released")
+            elif error is None:
+                self.pending[reservation_id] = record
+            elif product_id in self.remaining:
+                self.remaining[product_id] += quantity
+
+        # Отмена ожидающего запроса не отменяет запись: исход брони определяет только журнал
+        await asyncio.shield(self.journal.append(record, on_written))
+        if refused:
+            raise NotLeased(product_id)
+        metrics.inc("ledger.reservations")
+        return reservation_id
+
+    async def flush(self, rotate: bool = False) -> int:
+        async with self._flush_lock:
+            if self.journal.is_open and (rotate or self.pending):
+                self._closed_segments.append(await self.journal.rotate())
+            if not self.pending:
+                # Все записи закрытых сегментов уже в базе
+                self.journal.remove(self._closed_segments)
+                self._closed_segments = []
+                return 0
+            batch, self.pending = self.pending, {}
+            try:
+                await self._write(lambda session: apply_batch(session, list(batch.values())))
+            except BaseException:
+                self.pending = {**batch, **self.pending}
+                raise
+            self.journal.remove(self._closed_segments)
+            self._closed_segments = []
+
+        metrics.inc("ledger.flushed", len(batch))
+        for product_id in {record["product_id"] for record in batch.values()}:
+            if product_id in self.remaining:
+                dispatch(product_id, self.remaining[product_id])
+        return len(batch)
+
+    async def _run_write_behind(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"Ledger write-behind failed, will retry: {e}")
+
+
+inventory_ledger = InventoryLedger()
+metrics.register_gauge("ledger.pending", lambda: len(inventory_ledger.pending))
+metrics.register_gauge("ledger.leased_units", lambda: sum(inventory_ledger.remaining.values()))
@@ -1,16 +1,46 @@
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from app.db import set_db
+from app.db import engine, is_postgres, set_db
 from app.middleware import LoggingMiddleware
-from app.routes import router, reservation_router
+from app.routes import admin_router, router, reservation_router
 from app.logger import logger
+from app.notifications import stock_listener
+from app.writer import sqlite_writer
+from app.contention import CONTENTION_PROFILING, log_contention_summaries
+from app.procedures import install_procedures
+from app.aggregates import run_stats_reconciliation
+from app.ledger import INVENTORY_LEDGER, LEDGER_PRODUCTS, inventory_ledger
+from app.partitions import RESERVATIONS_PARTITIONING, run_partition_maintenance, setup_partitioned_reservations
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    if RESERVATIONS_PARTITIONING:
+        await setup_partitioned_reservations()
     await set_db()
+    await install_procedures()
     logger.info(f"Setting up database")
+    background = []
+    if CONTENTION_PROFILING:
+        background.append(asyncio.create_task(log_contention_summaries()))
+    if RESERVATIONS_PARTITIONING and is_postgres():
+        background.append(asyncio.create_task(run_partition_maintenance()))
+    background.append(asyncio.create_task(run_stats_reconciliation()))
+    if stock_listener is not None:
+        stock_listener.start()
+    if INVENTORY_LEDGER:
+        await inventory_ledger.start(engine)
+        for product_id in LEDGER_PRODUCTS:
+            await inventory_ledger.lease(product_id)
     yield
+    if stock_listener is not None:
+        await stock_listener.stop()
+    await inventory_ledger.stop()
+    await sqlite_writer.stop()
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
     logger.info(f"Shutting up connection")
 
 
@@ -18,4 +48,5 @@ app = FastAPI(lifespan=lifespan)
 app.add_middleware(LoggingMiddleware)
 app.include_router(reservation_router)
 app.include_router(router)
+app.include_router(admin_router)
 
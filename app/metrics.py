@@ -0,0 +1,31 @@
+from collections import defaultdict
+from typing import Callable
+
+_counters: defaultdict[str, int] = defaultdict(int)
+_gauges: dict[str, Callable[[], float | int]] = {}
+
+
+def inc(name: str, value: int = 1) -> None:
+    _counters[name] += value
+
+
+def register_gauge(name: str, getter: Callable[[], float | int]) -> None:
+    _gauges[name] = getter
+
+
+def hit_rate(hits: int, misses: int) -> float | None:
+    total = hits + misses
+    return round(hits / total, 4) if total else None
+
+
+def snapshot() -> dict:
+    data: dict = dict(sorted(_counters.items()))
+    for name, getter in sorted(_gauges.items()):
+        data[name] = getter()
+    for prefix in ("sql.compile_cache", "sql.prepared_cache"):
+        data[f"{prefix}.hit_rate"] = hit_rate(_counters.get(f"{prefix}.hit", 0), _counters.get(f"{prefix}.miss", 0))
+    return data
+
+
+def reset() -> None:
+    _counters.clear()
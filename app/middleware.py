@@ -1,5 +1,6 @@
 from fastapi.responses import JSONResponse
 from app.logger import logger
+from app.tracing import finish_trace, start_trace
 from starlette.middleware.base import BaseHTTPMiddleware
 from fastapi import Request
 
@@ -10,10 +11,16 @@ class LoggingMiddleware(BaseHTTPMiddleware):
         url = request.url.path
 
         logger.info(f"Incoming request: {method} {url}")
+        trace = start_trace()
 
         try:
             response = await call_next(request)
-            logger.info(f"Completed request: {method} {url} - Status: {response.status_code}")
+            if trace is not None:
+                logger.info(
+                    f"Completed request: {method} {url} - Status: {response.status_code} - {finish_trace(trace)}"
+                )
+            else:
+                logger.info(f"Completed request: {method} {url} - Status: {response.status_code}")
             return response
         except Exception as e:
             logger.exception(f"Unhandled exception for {method} {url}: {str(e)}")
@@ -1,8 +1,8 @@
 import enum
-from sqlalchemy import ForeignKey, Enum, DateTime, func
+from sqlalchemy import BigInteger, Date, ForeignKey, Enum, DateTime, Integer, func
 from sqlalchemy.orm import Mapped, mapped_column
 from app.db import Base
-from datetime import datetime
+from datetime import date, datetime
 
 
 class TaskStatus(enum.Enum):
@@ -21,11 +21,35 @@ class ProductsModel(Base):
 
 class ReservationsModel(Base):
     __tablename__ = 'reservations'
+    # В SQLite AUTOINCREMENT ведёт счётчик в sqlite_sequence, из него леджер берёт блоки id
+    __table_args__ = {"sqlite_autoincrement": True}
 
-    reservation_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    reservation_id: Mapped[int] = mapped_column(
+        BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True
+    )
     product_id: Mapped[int] = mapped_column(ForeignKey('products.product_id'))
     quantity: Mapped[int] = mapped_column(nullable=False)
     status: Mapped[TaskStatus] = mapped_column(
         Enum(TaskStatus, name="task_status_enum"), nullable=False, default=TaskStatus.pending
     )
     timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
+
+
+class ReservationStatsModel(Base):
+    __tablename__ = 'reservation_stats'
+
+    # Счётчики по товару, статусу и дню (UTC) обновляются в той же транзакции, что и бронирование
+    product_id: Mapped[int] = mapped_column(ForeignKey('products.product_id'), primary_key=True)
+    status: Mapped[TaskStatus] = mapped_column(Enum(TaskStatus, name="task_status_enum"), primary_key=True)
+    bucket: Mapped[date] = mapped_column(Date, primary_key=True)
+    reservations_count: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    quantity_total: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+
+
+class LedgerLeasesModel(Base):
+    __tablename__ = 'ledger_leases'
+
+    # Остаток, переданный из products в леджер процесса и ещё не списанный записанными бронированиями
+    product_id: Mapped[int] = mapped_column(ForeignKey('products.product_id'), primary_key=True)
+    quantity: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    leased_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
@@ -0,0 +1,140 @@
+import asyncio
+import json
+from typing import Callable
+
+from sqlalchemy import event, func, select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.db import DATABASE_URL, is_postgres
+from app.logger import logger
+
+STOCK_CHANNEL = "stock_changes"
+RECONNECT_DELAY_SECONDS = 1.0
+
+StockCallback = Callable[[int, int | None], None]
+
+_subscribers: list[StockCallback] = []
+_reset_subscribers: list[Callable[[], None]] = []
+
+
+def subscribe(callback: StockCallback, on_reset: Callable[[], None] | None = None) -> None:
+    _subscribers.append(callback)
+    if on_reset is not None:
+        _reset_subscribers.append(on_reset)
+
+
+def dispatch(product_id: int, available_quantity: int | None) -> None:
+    for callback in _subscribers:
+        try:
+            callback(product_id, available_quantity)
+        except Exception as e:
+            logger.exception(f"Stock change subscriber failed for product {product_id}: {e}")
+
+
+def dispatch_reset() -> None:
+    for callback in _reset_subscribers:
+        callback()
+
+
+def record_stock_change(session: AsyncSession, product_id: int, available_quantity: int | None) -> None:
+    # Подписчики своего процесса получают изменение сразу после commit из after_commit.
+    # В Postgres следом приходит и собственный NOTIFY: уведомления идут в порядке commit,
+    # поэтому повтор исправляет значение, которое обогнало чужое более раннее изменение
+    session.info.setdefault("stock_changes", []).append((product_id, available_quantity))
+
+
+async def notify_stock_change(session: AsyncSession, product_id: int, available_quantity: int | None) -> None:
+    # В Postgres NOTIFY доставляется всем воркерам только после commit
+    record_stock_change(session, product_id, available_quantity)
+    if session.get_bind().dialect.name == "postgresql":
+        payload = json.dumps({"product_id": product_id, "available_quantity": available_quantity})
+        await session.execute(select(func.pg_notify(STOCK_CHANNEL, payload)))
+
+
+notify_many_stmt = text(
+    "SELECT count(pg_notify(:channel, payload)) FROM unnest(CAST(:payloads AS text[])) AS payload"
+)
+
+
+async def notify_stock_changes(session: AsyncSession, changes: list[tuple[int, int | None]]) -> None:
+    # Пакетный вариант для массовых изменений: один запрос вместо NOTIFY на каждый товар
+    if not changes:
+        return
+    session.info.setdefault("stock_changes", []).extend(changes)
+    if session.get_bind().dialect.name == "postgresql":
+        payloads = [
+            json.dumps({"product_id": product_id, "available_quantity": available_quantity})
+            for product_id, available_quantity in changes
+        ]
+        await session.execute(notify_many_stmt, {"channel": STOCK_CHANNEL, "payloads": payloads})
+
+
+@event.listens_for(Session, "after_commit")
+def _dispatch_local_changes(session: Session) -> None:
+    for product_id, available_quantity in session.info.pop("stock_changes", []):
+        dispatch(product_id, available_quantity)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_local_changes(session: Session) -> None:
+    session.info.pop("stock_changes", None)
+
+
+class StockListener:
+    def __init__(self, url: str = DATABASE_URL, channel: str = STOCK_CHANNEL):
+        self.dsn = make_url(url).set(drivername="postgresql").render_as_string(hide_password=False)
+        self.channel = channel
+        self._task: asyncio.Task | None = None
+        self.ready = asyncio.Event()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self.ready.clear()
+
+    def _on_notification(self, connection, pid, channel, payload) -> None:
+        try:
+            data = json.loads(payload)
+            dispatch(int(data["product_id"]), data.get("available_quantity"))
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"Malformed {channel} notification {payload!r}: {e}")
+
+    async def _run(self) -> None:
+        import asyncpg
+
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(self.dsn)
+                terminated = asyncio.Event()
+                connection.add_termination_listener(lambda _: terminated.set())
+                await connection.add_listener(self.channel, self._on_notification)
+                # Пока слушателя не было, уведомления могли потеряться
+                dispatch_reset()
+                self.ready.set()
+                logger.info(f"Listening for {self.channel} notifications")
+                await terminated.wait()
+                self.ready.clear()
+                logger.warning(f"{self.channel} listener connection lost, reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"{self.channel} listener failed: {e}")
+            finally:
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+            await asyncio.sleep(RECONNECT_DELAY_SECONDS)
+
+
+stock_listener = StockListener() if is_postgres() else None
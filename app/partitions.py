@@ -0,0 +1,274 @@
+import asyncio
+import gzip
+import os
+import re
+from datetime import datetime, timezone
+from typing import Awaitable, TypeVar
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from app.db import Base, engine, is_postgres
+from app.logger import logger
+
+RESERVATIONS_PARTITIONING = os.getenv("RESERVATIONS_PARTITIONING", "false").lower() == "true"
+PARTITIONS_AHEAD = int(os.getenv("RESERVATIONS_PARTITIONS_AHEAD", "3"))
+RETAIN_MONTHS = int(os.getenv("RESERVATIONS_RETAIN_MONTHS", "12"))
+ARCHIVE_DIR = os.getenv("RESERVATIONS_ARCHIVE_DIR", "archive")
+MAINTENANCE_INTERVAL_SECONDS = int(os.getenv("PARTITION_MAINTENANCE_INTERVAL_SECONDS", "3600"))
+DETACH_LOCK_TIMEOUT_MS = int(os.getenv("PARTITION_DETACH_LOCK_TIMEOUT_MS", "2000"))
+
+# reservation_id = (номер месяца << MONTH_SHIFT) | значение последовательности,
+# поэтому по id сразу известна партиция, в которой лежит бронь
+MONTH_SHIFT = 40
+EPOCH_YEAR = 2000
+MAINTENANCE_LOCK_KEY = 7_270_001
+
+PARTITION_NAME_RE = re.compile(r"^reservations_p(\d{4})_(\d{2})$")
+
+T = TypeVar("T")
+
+
+def month_index(moment: datetime) -> int:
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc)
+    return (moment.year - EPOCH_YEAR) * 12 + moment.month
+
+
+def month_start(index: int) -> datetime:
+    year, month = divmod(index - 1, 12)
+    return datetime(EPOCH_YEAR + year, month + 1, 1, tzinfo=timezone.utc)
+
+
+def encode_reservation_id(moment: datetime, sequence_value: int) -> int:
+    return (month_index(moment) << MONTH_SHIFT) | sequence_value
+
+
+def reservation_month_bounds(reservation_id: int) -> tuple[datetime, datetime] | None:
+    index = reservation_id >> MONTH_SHIFT
+    if index <= 0:
+        return None
+    return month_start(index), month_start(index + 1)
+
+
+def partition_name(index: int) -> str:
+    start = month_start(index)
+    return f"reservations_p{start.year:04d}_{start.month:02d}"
+
+
+def partition_index(name: str) -> int | None:
+    match = PARTITION_NAME_RE.match(name)
+    if match is None:
+        return None
+    return month_index(datetime(int(match.group(1)), int(match.group(2)), 1))
+
+
+PARTITIONED_RESERVATIONS_DDL = [
+    "CREATE SEQUENCE IF NOT EXISTS reservations_reservation_id_seq",
+    """
+    CREATE TABLE IF NOT EXISTS reservations (
+        reservation_id BIGINT NOT NULL,
+        product_id INTEGER REFERENCES products (product_id),
+        quantity INTEGER NOT NULL,
+        status task_status_enum NOT NULL,
+        "timestamp" TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+        PRIMARY KEY (reservation_id, "timestamp")
+    ) PARTITION BY RANGE ("timestamp")
+    """,
+    "CREATE TABLE IF NOT EXISTS reservations_default PARTITION OF reservations DEFAULT",
+    f"""
+    CREATE OR REPLACE FUNCTION reservations_assign_id() RETURNS trigger AS $$
+    DECLARE
+        moment timestamp := coalesce(NEW."timestamp", now()) AT TIME ZONE 'UTC';
+    BEGIN
+        IF NEW.reservation_id IS NULL THEN
+            NEW.reservation_id := (
+                ((extract(year FROM moment)::bigint - {EPOCH_YEAR}) * 12 + extract(month FROM moment)::bigint)
+                << {MONTH_SHIFT}
+            ) | nextval('reservations_reservation_id_seq');
+        END IF;
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE OR REPLACE TRIGGER reservations_assign_id
+    BEFORE INSERT ON reservations
+    FOR EACH ROW EXECUTE FUNCTION reservations_assign_id()
+    """,
+]
+
+
+def _create_partitioned_schema(sync_conn) -> None:
+    from app.models import ProductsModel, ReservationsModel
+
+    Base.metadata.create_all(sync_conn, tables=[ProductsModel.__table__])
+    ReservationsModel.__table__.c.status.type.create(sync_conn, checkfirst=True)
+    for statement in PARTITIONED_RESERVATIONS_DDL:
+        sync_conn.exec_driver_sql(statement)
+
+
+async def setup_partitioned_reservations() -> None:
+    if not is_postgres():
+        logger.warning("Reservations partitioning requires PostgreSQL, keeping a plain table")
+        return
+    # Существующую обычную таблицу не конвертируем: CREATE TABLE IF NOT EXISTS её не тронет
+    async with engine.begin() as conn:
+        await conn.run_sync(_create_partitioned_schema)
+
+
+async def list_partitions(conn: AsyncConnection) -> list[str]:
+    result = await conn.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE parent.relname = 'reservations'"
+    ))
+    return list(result.scalars())
+
+
+async def list_detached_partitions(conn: AsyncConnection) -> list[str]:
+    # Секции, которые архивация уже отсоединила, но не успела выгрузить и удалить
+    result = await conn.execute(text(
+        "SELECT relname FROM pg_class "
+        "WHERE relkind = 'r' AND NOT relispartition AND relname LIKE 'reservations\\_p%'"
+    ))
+    return [name for name in result.scalars() if partition_index(name) is not None]
+
+
+async def default_partition_months(conn: AsyncConnection) -> list[int]:
+    result = await conn.execute(text(
+        "SELECT DISTINCT date_trunc('month', \"timestamp\" AT TIME ZONE 'UTC') FROM reservations_default"
+    ))
+    return [month_index(moment) for moment in result.scalars()]
+
+
+async def run_step(conn: AsyncConnection, description: str, step: Awaitable[T]) -> T | None:
+    # Каждый шаг обслуживания - своя транзакция: ошибка одного шага не отменяет остальные
+    try:
+        result = await step
+        await conn.commit()
+        return result
+    except Exception as e:
+        await conn.rollback()
+        logger.exception(f"Partition maintenance step {description} failed: {e}")
+        return None
+
+
+async def create_partition(conn: AsyncConnection, index: int) -> str:
+    name = partition_name(index)
+    start, end = month_start(index), month_start(index + 1)
+    # Пока секции месяца нет, его строки попадают в default, и CREATE TABLE ... PARTITION OF падает.
+    # Блокировка default останавливает только вставки, которые попали бы в неё, до конца транзакции
+    await conn.execute(text("LOCK TABLE reservations_default IN SHARE ROW EXCLUSIVE MODE"))
+    await conn.execute(text(f"CREATE TABLE {name} (LIKE reservations INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    await conn.execute(text(
+        f"WITH moved AS (DELETE FROM reservations_default "
+        f"WHERE \"timestamp\" >= :start AND \"timestamp\" < :end RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    ), {"start": start, "end": end})
+    await conn.execute(text(
+        f"ALTER TABLE reservations ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    ))
+    return name
+
+
+async def create_upcoming_partitions(conn: AsyncConnection, now: datetime, ahead: int = PARTITIONS_AHEAD) -> list[str]:
+    existing = set(await list_partitions(conn))
+    current = month_index(now)
+    # Месяцы из default тоже получают свои секции: будущие освобождают default, старые уходят в архив
+    months = set(range(current, current + ahead + 1)) | set(await default_partition_months(conn))
+    await conn.commit()
+    created = []
+    for index in sorted(months):
+        name = partition_name(index)
+        if name in existing:
+            continue
+        if await run_step(conn, f"create {name}", create_partition(conn, index)) is not None:
+            created.append(name)
+    return created
+
+
+async def export_partition(conn: AsyncConnection, name: str, path: str) -> None:
+    raw = await conn.get_raw_connection()
+    with gzip.open(path, "wb") as archive:
+        async def write(chunk: bytes) -> None:
+            archive.write(chunk)
+
+        await raw.driver_connection.copy_from_table(name, output=write, format="csv", header=True)
+
+
+async def detach_partition(conn: AsyncConnection, name: str) -> None:
+    # DETACH ... CONCURRENTLY недоступен, пока у таблицы есть секция default, поэтому отсоединение -
+    # отдельная короткая транзакция. lock_timeout не даёт ей ждать долгие транзакции,
+    # пока за её ACCESS EXCLUSIVE выстраиваются вставки
+    await conn.execute(
+        text("SELECT set_config('lock_timeout', :lock_timeout, true)"),
+        {"lock_timeout": f"{DETACH_LOCK_TIMEOUT_MS}ms"},
+    )
+    await conn.execute(text(f"ALTER TABLE reservations DETACH PARTITION {name}"))
+
+
+async def archive_partition(conn: AsyncConnection, name: str, archive_dir: str = ARCHIVE_DIR, attached: bool = True) -> str:
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+
+    if attached:
+        await detach_partition(conn, name)
+        await conn.commit()
+    # Выгрузка и удаление идут уже без блокировки reservations
+    await export_partition(conn, name, path)
+    await conn.execute(text(f"DROP TABLE {name}"))
+    return path
+
+
+async def archive_old_partitions(conn: AsyncConnection, now: datetime, retain_months: int = RETAIN_MONTHS) -> list[str]:
+    oldest_kept = month_index(now) - retain_months
+    detached = set(await list_detached_partitions(conn))
+    names = set(await list_partitions(conn)) | detached
+    await conn.commit()
+    archived = []
+    for name in sorted(names):
+        index = partition_index(name)
+        if index is None or index >= oldest_kept:
+            continue
+        path = await run_step(conn, f"archive {name}", archive_partition(conn, name, attached=name not in detached))
+        if path is not None:
+            archived.append(path)
+    return archived
+
+
+async def maintain_partitions(now: datetime | None = None) -> None:
+    now = now or datetime.now(timezone.utc)
+    async with engine.connect() as conn:
+        # При нескольких воркерах обслуживанием занимается только один. Блокировка сессионная:
+        # она держится между транзакциями отдельных шагов
+        locked = await conn.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": MAINTENANCE_LOCK_KEY})
+        await conn.commit()
+        if not locked:
+            return
+        try:
+            created = await create_upcoming_partitions(conn, now)
+            archived = await archive_old_partitions(conn, now)
+        finally:
+            await conn.rollback()
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MAINTENANCE_LOCK_KEY})
+            await conn.commit()
+    if created or archived:
+        logger.info(f"Reservations partitions created: {created}, archived: {archived}")
+
+
+async def run_partition_maintenance() -> None:
+    while True:
+        try:
+            await maintain_partitions()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.exception(f"Partition maintenance failed: {e}")
+        await asyncio.sleep(MAINTENANCE_INTERVAL_SECONDS)
+
+
+if __name__ == "__main__":
+    asyncio.run(maintain_partitions())
@@ -0,0 +1,74 @@
+import os
+
+from sqlalchemy import text
+
+from app.db import engine, is_postgres
+from app.logger import logger
+from app.notifications import STOCK_CHANNEL
+
+RESERVE_ENGINE = os.getenv("RESERVE_ENGINE", "orm").lower()
+if RESERVE_ENGINE not in ("orm", "procedure"):
+    raise ValueError(f"Unknown RESERVE_ENGINE {RESERVE_ENGINE!r}, expected 'orm' or 'procedure'")
+if RESERVE_ENGINE == "procedure" and not is_postgres():
+    logger.warning("RESERVE_ENGINE=procedure requires PostgreSQL, falling back to orm")
+    RESERVE_ENGINE = "orm"
+
+# Коды исхода совпадают с ветками ORM-реализации reserve()
+OUTCOME_OK = "ok"
+OUTCOME_NOT_FOUND = "not_found"
+OUTCOME_INSUFFICIENT_STOCK = "insufficient_stock"
+
+INSTALL_LOCK_KEY = 7_270_002
+
+RESERVE_PRODUCT_FUNCTION_DDL = f"""
+CREATE OR REPLACE FUNCTION reserve_product(p_product_id integer, p_quantity integer, p_timestamp timestamptz)
+RETURNS TABLE (outcome text, new_reservation_id bigint, remaining_quantity integer) AS $$
+DECLARE
+    current_quantity integer;
+BEGIN
+    SELECT products.available_quantity INTO current_quantity
+    FROM products WHERE products.product_id = p_product_id
+    FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RETURN QUERY SELECT '{OUTCOME_NOT_FOUND}'::text, NULL::bigint, NULL::integer;
+        RETURN;
+    END IF;
+
+    IF current_quantity < p_quantity THEN
+        RETURN QUERY SELECT '{OUTCOME_INSUFFICIENT_STOCK}'::text, NULL::bigint, current_quantity;
+        RETURN;
+    END IF;
+
+    remaining_quantity := current_quantity - p_quantity;
+    UPDATE products SET available_quantity = remaining_quantity WHERE products.product_id = p_product_id;
+
+    INSERT INTO reservations (product_id, quantity, status, "timestamp")
+    VALUES (p_product_id, p_quantity, 'completed', p_timestamp)
+    RETURNING reservations.reservation_id INTO new_reservation_id;
+
+    INSERT INTO reservation_stats AS stats (product_id, status, bucket, reservations_count, quantity_total)
+    VALUES (p_product_id, 'completed', (p_timestamp AT TIME ZONE 'UTC')::date, 1, p_quantity)
+    ON CONFLICT (product_id, status, bucket) DO UPDATE
+    SET reservations_count = stats.reservations_count + 1, quantity_total = stats.quantity_total + p_quantity;
+
+    PERFORM pg_notify(
+        '{STOCK_CHANNEL}',
+        json_build_object('product_id', p_product_id, 'available_quantity', remaining_quantity)::text
+    );
+
+    outcome := '{OUTCOME_OK}';
+    RETURN NEXT;
+END
+$$ LANGUAGE plpgsql
+"""
+
+
+async def install_procedures() -> None:
+    if RESERVE_ENGINE != "procedure":
+        return
+    async with engine.begin() as conn:
+        # Воркеры стартуют одновременно, а параллельные CREATE OR REPLACE одной функции падают
+        # с "tuple concurrently updated"
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": INSTALL_LOCK_KEY})
+        await conn.exec_driver_sql(RESERVE_PRODUCT_FUNCTION_DDL)
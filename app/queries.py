@@ -0,0 +1,103 @@
+from sqlalchemy import DateTime, Integer, bindparam, event, insert, select, text, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.default import CACHE_HIT
+
+from app import metrics
+from app.db import engine
+from app.logger import logger
+from app.models import ProductsModel, ReservationsModel
+from app.procedures import RESERVE_ENGINE
+from app.deadlines import set_timeouts_stmt
+from app.aggregates import upsert_stats_stmts
+
+# Горячий путь собирается один раз при импорте: ключ кэша компиляции у готового
+# выражения мемоизирован, а одинаковый SQL даёт попадание в кэш prepared statements
+lock_stock_stmt = (
+    select(ProductsModel.available_quantity)
+    .where(ProductsModel.product_id == bindparam("product_id"))
+    .with_for_update()
+)
+
+set_stock_stmt = (
+    update(ProductsModel)
+    .where(ProductsModel.product_id == bindparam("target_product_id"))
+    .values(available_quantity=bindparam("new_quantity"))
+)
+
+insert_reservation_stmt = (
+    insert(ReservationsModel)
+    .values(
+        product_id=bindparam("reserved_product_id"),
+        quantity=bindparam("reserved_quantity"),
+        status=bindparam("reservation_status", type_=ReservationsModel.status.type),
+        timestamp=bindparam("reserved_at", type_=ReservationsModel.timestamp.type),
+    )
+    .returning(ReservationsModel.reservation_id)
+)
+
+reservation_status_stmt = (
+    select(ReservationsModel.status)
+    .where(ReservationsModel.reservation_id == bindparam("reservation_id"))
+)
+
+reservation_status_in_month_stmt = reservation_status_stmt.where(
+    ReservationsModel.timestamp >= bindparam("month_start"),
+    ReservationsModel.timestamp < bindparam("month_end"),
+)
+
+reserve_product_stmt = text(
+    "SELECT outcome, new_reservation_id, remaining_quantity "
+    "FROM reserve_product(:product_id, :quantity, :reserved_at)"
+).bindparams(
+    bindparam("product_id", type_=Integer),
+    bindparam("quantity", type_=Integer),
+    bindparam("reserved_at", type_=DateTime(timezone=True)),
+)
+
+HOT_PATH_STATEMENTS = [
+    set_timeouts_stmt,
+    reservation_status_stmt,
+    reservation_status_in_month_stmt,
+]
+if RESERVE_ENGINE == "procedure":
+    HOT_PATH_STATEMENTS.append(reserve_product_stmt)
+else:
+    HOT_PATH_STATEMENTS += [lock_stock_stmt, set_stock_stmt, insert_reservation_stmt, upsert_stats_stmts["postgresql"]]
+
+
+def _prepared_cache(dbapi_connection):
+    # LRU-кэш prepared statements адаптера asyncpg в SQLAlchemy, у других драйверов его нет
+    return getattr(dbapi_connection, "_prepared_statement_cache", None)
+
+
+def prepare_hot_path(dbapi_connection, connection_record) -> None:
+    # Готовим через _prepare адаптера: он кладёт statement в тот же LRU-кэш, из которого читает execute.
+    # Публичный Connection.prepare() asyncpg кэш адаптера не заполняет, и первое выполнение готовило бы запрос снова
+    prepare = getattr(dbapi_connection, "_prepare", None)
+    invalidate_asof = getattr(dbapi_connection, "_invalidate_schema_cache_asof", None)
+    if prepare is None or invalidate_asof is None or _prepared_cache(dbapi_connection) is None:
+        return
+    dialect = engine.sync_engine.dialect
+    for stmt in HOT_PATH_STATEMENTS:
+        sql = str(stmt.compile(dialect=dialect))
+        try:
+            dbapi_connection.await_(prepare(sql, invalidate_asof))
+        except Exception as e:
+            # Соединение могло открыться до create_all или install_procedures, остальные запросы готовим дальше
+            logger.warning(f"Could not prepare hot path statement {sql.split(None, 1)[0]} on new connection: {e}")
+
+
+def record_cache_usage(conn, cursor, statement, parameters, context, executemany) -> None:
+    metrics.inc("sql.compile_cache.hit" if context.cache_hit is CACHE_HIT else "sql.compile_cache.miss")
+
+    cache = _prepared_cache(conn.connection.dbapi_connection)
+    if cache is not None:
+        metrics.inc("sql.prepared_cache.hit" if statement in cache else "sql.prepared_cache.miss")
+
+
+def instrument(target: Engine) -> None:
+    event.listen(target, "connect", prepare_hot_path)
+    event.listen(target, "before_cursor_execute", record_cache_usage)
+
+
+instrument(engine.sync_engine)
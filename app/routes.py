@@ -1,89 +1,358 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import StreamingResponse
 from app.logger import logger
-from app.schema import Reservation, ResponseReservation, ResponseType
-from typing import Annotated
+from app.schema import (
+    ImportMode,
+    ImportSummary,
+    ProductStats,
+    Reservation,
+    ResponseProduct,
+    ResponseReservation,
+    ResponseType,
+    StatsBucket,
+    StatsTotal,
+)
+from typing import Annotated, Awaitable
 from app.db import AsyncSession, get_db
 from app.models import ProductsModel, ReservationsModel, TaskStatus
-from sqlalchemy import select, update, func
-from datetime import datetime
+from app.cache import product_cache
+from app.notifications import notify_stock_change, record_stock_change
+from app.partitions import RESERVATIONS_PARTITIONING, reservation_month_bounds
+from app.procedures import OUTCOME_INSUFFICIENT_STOCK, OUTCOME_NOT_FOUND, OUTCOME_OK, RESERVE_ENGINE
+from app.queries import (
+    insert_reservation_stmt,
+    lock_stock_stmt,
+    reservation_status_in_month_stmt,
+    reservation_status_stmt,
+    reserve_product_stmt,
+    set_stock_stmt,
+)
+from app.writer import sqlite_writer
+from app.contention import LockTimer, contention_profiler
+from app.admission import Overloaded, admission_controller, overloaded_response
+from app.importer import import_products
+from app.aggregates import (
+    STATS_RECONCILE_DAYS,
+    product_stats,
+    reconcile_reservation_stats,
+    record_reservation_stats,
+)
+from app.tracing import span, traced
+from app.ledger import NotLeased, inventory_ledger
+from app.stream import stock_broadcaster, stock_events
+from app.deadlines import Deadline, apply_db_timeouts, is_timeout_error, request_deadline, run_until_deadline, timed_out
+from app import metrics
+from sqlalchemy import select, func
+from sqlalchemy.exc import DBAPIError
+from datetime import date, datetime
 
 
 router = APIRouter(tags=["public"])
 reservation_router = APIRouter(prefix="/reservation", tags=["reservation"])
+admin_router = APIRouter(prefix="/admin", tags=["admin"])
 
 SessionDep = Annotated[AsyncSession, Depends(get_db)]
 
 
-@reservation_router.post("/reserve", response_model=ResponseReservation)
-async def reserve(reservation: Reservation, session: SessionDep) -> ResponseReservation:
-    logger.info(f"Attempting reservation: {reservation.model_dump()}")
-
-    res = await session.get(ProductsModel, reservation.product_id)
+def product_not_found(product_id: int) -> HTTPException:
+    logger.error(f"Product {product_id} not found")
+    return HTTPException(
+        status_code=status.HTTP_404_NOT_FOUND,
+        detail={
+            "status": ResponseType.error.value,
+            "message": "Invalid product ID.",
+            "reservation_id": None
+        }
+    )
 
-    if res is None:
-        logger.error(f"Product {reservation.product_id} not found")
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail={
-                "status": ResponseType.error.value,
-                "message": "Invalid product ID.",
-                "reservation_id": None
-            }
-        )
 
-    stmt = (
-        select(ProductsModel.available_quantity)
-        .where(reservation.product_id == ProductsModel.product_id)
-        .with_for_update()
+def insufficient_stock(product_id: int) -> HTTPException:
+    logger.warning(f"Insufficient stock for product {product_id}")
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail={
+            "status": ResponseType.error.value,
+            "message": f"Not enough stock available.",
+            "reservation_id": None
+        }
     )
-    result = await session.execute(stmt)
-    available_quantity = result.scalar_one()
+
+
+async def reserve_with_orm(session: AsyncSession, reservation: Reservation, deadline: Deadline | None = None) -> int:
+    with span("checkout"):
+        await session.connection()
+    await apply_db_timeouts(session, deadline)
+
+    # Блокировка строки заодно проверяет, что товар существует
+    timer = LockTimer()
+    result = await session.execute(lock_stock_stmt, {"product_id": reservation.product_id})
+    timer.lock_acquired()
+    available_quantity = result.scalar_one_or_none()
+
+    if available_quantity is None:
+        raise product_not_found(reservation.product_id)
+
     if available_quantity < reservation.quantity:
-        logger.warning(f"Insufficient stock for product {reservation.product_id}")
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail={
-                "status": ResponseType.error.value,
-                "message": f"Not enough stock available.",
-                "reservation_id": None
-            }
-        )
+        timer.record(reservation.product_id)
+        raise insufficient_stock(reservation.product_id)
 
-    await session.execute(
-        update(ProductsModel)
-        .where(reservation.product_id == ProductsModel.product_id)
-        .values(available_quantity=available_quantity - reservation.quantity)
-    )
+    new_quantity = available_quantity - reservation.quantity
+    await session.execute(set_stock_stmt, {
+        "target_product_id": reservation.product_id,
+        "new_quantity": new_quantity,
+    })
+    await notify_stock_change(session, reservation.product_id, new_quantity)
 
-    reservation_row = ReservationsModel(
-        product_id=reservation.product_id,
-        quantity=reservation.quantity,
-        status=TaskStatus.completed,
-        timestamp=reservation.timestamp
+    result = await session.execute(insert_reservation_stmt, {
+        "reserved_product_id": reservation.product_id,
+        "reserved_quantity": reservation.quantity,
+        "reservation_status": TaskStatus.completed,
+        "reserved_at": reservation.timestamp,
+    })
+    reservation_id = result.scalar_one()
+    # Строка счётчиков горячего товара не добавляет конкуренции: её пишут только под блокировкой товара
+    await record_reservation_stats(
+        session, reservation.product_id, TaskStatus.completed, reservation.timestamp, reservation.quantity
     )
-    session.add(reservation_row)
 
-    await session.commit()
-    await session.refresh(reservation_row)
+    if deadline is not None:
+        deadline.start_commit()
+    with span("commit"):
+        await session.commit()
+    timer.record(reservation.product_id)
+    return reservation_id
+
+
+async def reserve_with_procedure(
+    session: AsyncSession, reservation: Reservation, deadline: Deadline | None = None
+) -> int:
+    with span("checkout"):
+        await session.connection()
+    await apply_db_timeouts(session, deadline)
+
+    # Ожидание и удержание блокировки внутри функции не разделить, всё время учитывается как удержание
+    timer = LockTimer()
+    result = await session.execute(reserve_product_stmt, {
+        "product_id": reservation.product_id,
+        "quantity": reservation.quantity,
+        "reserved_at": reservation.timestamp,
+    })
+    outcome, reservation_id, remaining_quantity = result.one()
+    if outcome == OUTCOME_OK:
+        # NOTIFY отправляет сама функция, своему процессу изменение раздаётся после commit
+        record_stock_change(session, reservation.product_id, remaining_quantity)
+    if deadline is not None:
+        deadline.start_commit()
+    with span("commit"):
+        await session.commit()
+    if outcome != OUTCOME_NOT_FOUND:
+        timer.record(reservation.product_id)
+
+    if outcome == OUTCOME_NOT_FOUND:
+        raise product_not_found(reservation.product_id)
+    if outcome == OUTCOME_INSUFFICIENT_STOCK:
+        raise insufficient_stock(reservation.product_id)
+    return reservation_id
+
+
+async def reserve_with_ledger(session: AsyncSession, reservation: Reservation, deadline: Deadline) -> int:
+    try:
+        reservation_id = await inventory_ledger.reserve(
+            reservation.product_id, reservation.quantity, reservation.timestamp, on_commit=deadline.start_commit
+        )
+    except NotLeased:
+        # Аренду вернули в базу, пока запрос шёл сюда
+        return await reserve_with_engine(session, reservation, deadline)
+    if reservation_id is None:
+        raise insufficient_stock(reservation.product_id)
+    return reservation_id
+
 
-    logger.info(f"Reservation successful: {reservation_row.reservation_id}")
+def reserve_with_engine(session: AsyncSession, reservation: Reservation, deadline: Deadline) -> Awaitable[int]:
+    if inventory_ledger.owns(reservation.product_id):
+        return reserve_with_ledger(session, reservation, deadline)
+    if RESERVE_ENGINE == "procedure":
+        return reserve_with_procedure(session, reservation, deadline)
+    if session.bind.dialect.name == "sqlite":
+        return sqlite_writer.submit(
+            session.bind, lambda write_session: reserve_with_orm(write_session, reservation, deadline)
+        )
+    return reserve_with_orm(session, reservation, deadline)
+
+
+@reservation_router.post("/reserve", response_model=ResponseReservation)
+@traced
+async def reserve(reservation: Reservation, session: SessionDep, request: Request) -> ResponseReservation:
+    logger.info(f"Attempting reservation: {reservation.model_dump()}")
+    deadline = request_deadline(request)
+
+    try:
+        per_product = not inventory_ledger.owns(reservation.product_id)
+        async with admission_controller.admit(reservation.product_id, deadline.remaining(), per_product):
+            work = reserve_with_engine(session, reservation, deadline)
+            reservation_id = await run_until_deadline(request, deadline, work)
+    except Overloaded as e:
+        raise overloaded_response(e)
+    except DBAPIError as e:
+        if not is_timeout_error(e):
+            raise
+        logger.warning(f"Reservation for product {reservation.product_id} hit the database timeout")
+        raise timed_out()
+
+    logger.info(f"Reservation successful: {reservation_id}")
     return ResponseReservation(
         status=ResponseType.success,
         message=f"Reservation completed successfully.",
-        reservation_id=reservation_row.reservation_id
+        reservation_id=reservation_id
     )
 
 
 @reservation_router.get("/{reservation_id}")
+@traced
 async def get_reservation(reservation_id: int, session: SessionDep):
-    stmt = select(ReservationsModel.status).where(reservation_id == ReservationsModel.reservation_id)
-    result = await session.execute(stmt)
+    with span("checkout"):
+        await session.connection()
+    bounds = reservation_month_bounds(reservation_id) if RESERVATIONS_PARTITIONING else None
+    if bounds is not None:
+        # Месяц зашит в id, условие по timestamp отсекает все остальные партиции
+        result = await session.execute(reservation_status_in_month_stmt, {
+            "reservation_id": reservation_id,
+            "month_start": bounds[0],
+            "month_end": bounds[1],
+        })
+    else:
+        result = await session.execute(reservation_status_stmt, {"reservation_id": reservation_id})
     result_status = result.scalar_one_or_none()
+    if result_status is None and inventory_ledger.is_pending(reservation_id):
+        # Бронь леджера подтверждена журналом, но ещё не записана в базу
+        return {"status": TaskStatus.completed.value}
     if result_status is None:
         return {"status": "reservation_id does not exist"}
     return {"status": result_status.value}
 
 
+@router.post("/products/import", response_model=ImportSummary)
+async def import_products_csv(request: Request, session: SessionDep, mode: ImportMode = ImportMode.add) -> ImportSummary:
+    # Тело запроса - CSV с колонками product_name,quantity, разбирается по мере поступления
+    try:
+        return await import_products(session, request.stream(), mode)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"status": ResponseType.error.value, "message": str(e)}
+        )
+
+
+@router.get("/products/stream")
+async def stream_products():
+    if stock_broadcaster.is_full():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail={"status": ResponseType.error.value, "message": "Too many stream subscribers."},
+            headers={"Retry-After": "5"},
+        )
+    return StreamingResponse(
+        stock_events(stock_broadcaster),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/products/{product_id}", response_model=ResponseProduct)
+async def get_product(product_id: int, session: SessionDep) -> ResponseProduct:
+    leased = inventory_ledger.available(product_id)
+    cached = product_cache.get(product_id)
+    if cached is not None:
+        return cached if leased is None else cached.model_copy(update={"available_quantity": leased})
+
+    generation = product_cache.generation()
+    product = await session.get(ProductsModel, product_id)
+    if product is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail={"status": ResponseType.error.value, "message": "Invalid product ID."}
+        )
+
+    response = ResponseProduct(
+        product_id=product.product_id,
+        product_name=product.product_name,
+        available_quantity=product.available_quantity
+    )
+    product_cache.set(product_id, response, generation)
+    # Пока товар в аренде, в products лежит ноль, актуальный остаток знает только леджер
+    return response if leased is None else response.model_copy(update={"available_quantity": leased})
+
+
+@router.get("/products/{product_id}/stats", response_model=ProductStats)
+async def get_product_stats(
+    product_id: int, session: SessionDep, start: date | None = None, end: date | None = None
+) -> ProductStats:
+    # Читаются только готовые счётчики по дням, таблица бронирований не сканируется
+    rows = await product_stats(session, product_id, start, end)
+    totals: dict[str, StatsTotal] = {}
+    for row in rows:
+        total = totals.setdefault(row.status.value, StatsTotal(reservations=0, quantity=0))
+        total.reservations += row.reservations_count
+        total.quantity += row.quantity_total
+    return ProductStats(
+        product_id=product_id,
+        totals=totals,
+        buckets=[
+            StatsBucket(
+                bucket=row.bucket,
+                status=row.status.value,
+                reservations=row.reservations_count,
+                quantity=row.quantity_total,
+            )
+            for row in rows
+        ],
+    )
+
+
+@router.get("/metrics")
+async def get_metrics():
+    return metrics.snapshot()
+
+
+@admin_router.get("/contention")
+async def get_contention(limit: int = 10):
+    return contention_profiler.report(limit)
+
+
+@admin_router.post("/stats/reconcile")
+async def reconcile_product_stats(session: SessionDep, days: int = STATS_RECONCILE_DAYS):
+    repaired = await reconcile_reservation_stats(session, days)
+    return {"repaired_buckets": repaired}
+
+
+def ledger_disabled() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail={"status": ResponseType.error.value, "message": "Inventory ledger is not enabled."}
+    )
+
+
+@admin_router.post("/ledger/{product_id}/lease")
+async def lease_product(product_id: int):
+    if not inventory_ledger.running:
+        raise ledger_disabled()
+    leased = await inventory_ledger.lease(product_id)
+    if leased is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail={"status": ResponseType.error.value, "message": "Invalid product ID."}
+        )
+    return {"product_id": product_id, "leased": leased, "available_quantity": inventory_ledger.available(product_id)}
+
+
+@admin_router.post("/ledger/{product_id}/release")
+async def release_product(product_id: int):
+    if not inventory_ledger.running:
+        raise ledger_disabled()
+    returned = await inventory_ledger.release(product_id)
+    return {"product_id": product_id, "returned": returned}
+
+
 @router.get("/seed-data")
 async def seed_database(session: SessionDep):
     logger.info("Запрос на заполнение базы данных тестовыми данными")
@@ -145,6 +414,10 @@ async def seed_database(session: SessionDep):
         ]
         
         session.add_all(reservations)
+        for reservation in reservations:
+            await record_reservation_stats(
+                session, reservation.product_id, reservation.status, reservation.timestamp, reservation.quantity
+            )
         await session.commit()
         
         logger.info(f"База данных заполнена: {len(products)} продуктов, {len(reservations)} резерваций")
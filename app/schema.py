@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import date, datetime
 from pydantic import BaseModel, PositiveInt
 import enum
 
@@ -23,3 +23,42 @@ class ResponseReservation(BaseModel):
     status: ResponseType
     message: str
     reservation_id: PositiveInt
+
+
+class ResponseProduct(BaseModel):
+    product_id: PositiveInt
+    product_name: str
+    available_quantity: int
+
+
+class ImportMode(enum.Enum):
+    add = "add"
+    set = "set"
+
+
+class ImportSummary(BaseModel):
+    rows_total: int
+    products_updated: int
+    products_created: int
+    rows_rejected: int
+    seconds: float
+    rows_per_second: float
+    errors: list[str]
+
+
+class StatsBucket(BaseModel):
+    bucket: date
+    status: str
+    reservations: int
+    quantity: int
+
+
+class StatsTotal(BaseModel):
+    reservations: int
+    quantity: int
+
+
+class ProductStats(BaseModel):
+    product_id: int
+    totals: dict[str, StatsTotal]
+    buckets: list[StatsBucket]
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import os
+from typing import AsyncIterator
+
+from app import metrics, notifications
+
+STREAM_MAX_SUBSCRIBERS = int(os.getenv("STREAM_MAX_SUBSCRIBERS", "10000"))
+STREAM_BUFFER_SIZE = int(os.getenv("STREAM_BUFFER_SIZE", "256"))
+STREAM_KEEPALIVE_SECONDS = float(os.getenv("STREAM_KEEPALIVE_SECONDS", "15"))
+STREAM_RETRY_MS = 3000
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class Subscriber:
+    # Буфер хранит только последний остаток по каждому товару, поэтому всплеск изменений
+    # одного товара занимает одну ячейку. Переполняется он только у клиента, который не успевает читать
+    def __init__(self, max_pending: int = STREAM_BUFFER_SIZE):
+        self.max_pending = max_pending
+        self.pending: dict[int, int] = {}
+        self.reset = False
+        self.dropped = False
+        self.ready = asyncio.Event()
+
+    def push(self, product_id: int, available_quantity: int) -> bool:
+        if product_id not in self.pending and len(self.pending) >= self.max_pending:
+            self.dropped = True
+            self.ready.set()
+            return False
+        self.pending[product_id] = available_quantity
+        self.ready.set()
+        return True
+
+    def push_reset(self) -> None:
+        self.pending.clear()
+        self.reset = True
+        self.ready.set()
+
+    def drain(self) -> tuple[bool, dict[int, int]]:
+        reset, pending = self.reset, self.pending
+        self.reset, self.pending = False, {}
+        self.ready.clear()
+        return reset, pending
+
+
+class StockBroadcaster:
+    def __init__(self, max_subscribers: int = STREAM_MAX_SUBSCRIBERS):
+        self.max_subscribers = max_subscribers
+        self.subscribers: set[Subscriber] = set()
+
+    def is_full(self) -> bool:
+        return len(self.subscribers) >= self.max_subscribers
+
+    def subscribe(self) -> Subscriber:
+        if self.is_full():
+            raise TooManySubscribers()
+        subscriber = Subscriber()
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        self.subscribers.discard(subscriber)
+
+    def publish(self, product_id: int, available_quantity: int | None) -> None:
+        if available_quantity is None:
+            return
+        for subscriber in list(self.subscribers):
+            if not subscriber.push(product_id, available_quantity):
+                self.unsubscribe(subscriber)
+                metrics.inc("stream.dropped_subscribers")
+
+    def publish_reset(self) -> None:
+        for subscriber in self.subscribers:
+            subscriber.push_reset()
+
+
+def format_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stock_events(
+    broadcaster: "StockBroadcaster", keepalive: float = STREAM_KEEPALIVE_SECONDS
+) -> AsyncIterator[str]:
+    # Подписываемся только когда ответ начал отдаваться: если клиент ушёл раньше,
+    # генератор не стартует и подписчик не повиснет в broadcaster
+    try:
+        subscriber = broadcaster.subscribe()
+    except TooManySubscribers:
+        yield format_event("dropped", {"reason": "too many subscribers"})
+        return
+    try:
+        yield f"retry: {STREAM_RETRY_MS}\n\n"
+        while True:
+            try:
+                await asyncio.wait_for(subscriber.ready.wait(), keepalive)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+
+            if subscriber.dropped:
+                # Клиент должен переподключиться и перечитать остатки
+                yield format_event("dropped", {"reason": "slow consumer"})
+                return
+
+            reset, pending = subscriber.drain()
+            chunk = format_event("reset", {}) if reset else ""
+            chunk += "".join(
+                format_event("stock", {"product_id": product_id, "available_quantity": available_quantity})
+                for product_id, available_quantity in pending.items()
+            )
+            if chunk:
+                yield chunk
+    finally:
+        broadcaster.unsubscribe(subscriber)
+
+
+stock_broadcaster = StockBroadcaster()
+notifications.subscribe(stock_broadcaster.publish, on_reset=stock_broadcaster.publish_reset)
+metrics.register_gauge("stream.subscribers", lambda: len(stock_broadcaster.subscribers))
@@ -0,0 +1,159 @@
+import functools
+import os
+import random
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Iterator
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import metrics
+from app.db import engine
+from app.logger import logger
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+TRACE_MAX_SPANS = 64
+SLOW_QUERY_MAX_CHARS = 500
+
+TABLE_RE = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+\"?(\w+)", re.IGNORECASE)
+
+
+class RequestTrace:
+    # Фазы запроса в порядке выполнения: validation, checkout, каждый SQL, commit, serialize
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: list[tuple[str, float]] = []
+        self.dropped_spans = 0
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+        self.handler_finished: float | None = None
+
+    def add(self, name: str, seconds: float) -> None:
+        if len(self.spans) < TRACE_MAX_SPANS:
+            self.spans.append((name, seconds))
+        else:
+            self.dropped_spans += 1
+
+    def add_statement(self, statement: str, seconds: float, error: BaseException | None = None) -> None:
+        self.sql_statements += 1
+        self.sql_seconds += seconds
+        suffix = f"!{type(error).__name__}" if error is not None else ""
+        self.add(f"sql:{statement_label(statement)}{suffix}", seconds)
+
+    def summary(self) -> str:
+        total = time.perf_counter() - self.started
+        parts = [f"{name}={seconds * 1000:.2f}ms" for name, seconds in self.spans]
+        if self.dropped_spans:
+            parts.append(f"+{self.dropped_spans} spans")
+        parts.append(f"sql={self.sql_statements}/{self.sql_seconds * 1000:.2f}ms")
+        parts.append(f"total={total * 1000:.2f}ms")
+        return "trace " + " ".join(parts)
+
+
+current_trace: ContextVar[RequestTrace | None] = ContextVar("current_trace", default=None)
+
+
+def statement_label(statement: str) -> str:
+    verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "?"
+    match = TABLE_RE.search(statement)
+    return f"{verb} {match.group(1)}" if match else verb
+
+
+def start_trace() -> RequestTrace | None:
+    if TRACE_SAMPLE_RATE <= 0 or random.random() >= TRACE_SAMPLE_RATE:
+        return None
+    trace = RequestTrace()
+    current_trace.set(trace)
+    return trace
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - started)
+
+
+@contextmanager
+def traced_handler() -> Iterator[None]:
+    # Всё от входа в middleware до тела обработчика - разбор и валидация запроса и зависимости,
+    # всё после выхода из обработчика до ответа - сериализация
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add("validation", time.perf_counter() - trace.started)
+    try:
+        yield
+    finally:
+        if trace is not None:
+            trace.handler_finished = time.perf_counter()
+
+
+def traced(handler: Callable[..., Awaitable[Any]]) -> Callable[..., Awaitable[Any]]:
+    # functools.wraps сохраняет сигнатуру, по ней FastAPI собирает зависимости обработчика
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        with traced_handler():
+            return await handler(*args, **kwargs)
+
+    return wrapper
+
+
+def finish_trace(trace: RequestTrace) -> str:
+    if trace.handler_finished is not None:
+        trace.add("serialize", time.perf_counter() - trace.handler_finished)
+    return trace.summary()
+
+
+def start_query_timer(conn, cursor, statement, parameters, context, executemany) -> None:
+    context._query_started = time.perf_counter()
+
+
+def record_query(statement: str, elapsed: float, error: BaseException | None = None) -> None:
+    trace = current_trace.get()
+    if trace is not None:
+        trace.add_statement(statement, elapsed, error)
+
+    if SLOW_QUERY_MS > 0 and elapsed * 1000 >= SLOW_QUERY_MS:
+        metrics.inc("sql.slow_queries")
+        outcome = f" failed with {type(error).__name__}" if error is not None else ""
+        # Параметры не пишутся: в них могут быть данные клиентов
+        logger.warning(
+            f"Slow query {elapsed * 1000:.1f} ms ({statement_label(statement)}){outcome}: "
+            f"{' '.join(statement.split())[:SLOW_QUERY_MAX_CHARS]}"
+        )
+
+
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany) -> None:
+    started = getattr(context, "_query_started", None)
+    if started is None:
+        return
+    record_query(statement, time.perf_counter() - started)
+
+
+def record_failed_query(exception_context) -> None:
+    # Запросы, упавшие по lock_timeout или statement_timeout, обычно и есть самые долгие
+    started = getattr(exception_context.execution_context, "_query_started", None)
+    if started is None or exception_context.statement is None:
+        return
+    record_query(
+        exception_context.statement, time.perf_counter() - started, exception_context.original_exception
+    )
+
+
+def instrument(target: Engine) -> None:
+    event.listen(target, "before_cursor_execute", start_query_timer)
+    event.listen(target, "after_cursor_execute", stop_query_timer)
+    event.listen(target, "handle_error", record_failed_query)
+
+
+instrument(engine.sync_engine)
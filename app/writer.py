@@ -0,0 +1,93 @@
+import asyncio
+import contextvars
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from app.logger import logger
+
+WriteJob = Callable[[AsyncSession], Awaitable[Any]]
+
+
+class SerializedWriter:
+    # В SQLite нет блокировок строк, поэтому все списания остатков выполняет одна задача по очереди
+    def __init__(self):
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def _ensure_started(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._task is not None and self._loop is loop and not self._task.done():
+            return
+        if self._task is not None and self._loop is loop:
+            # Писатель умер: задачи из его очереди уже никто не выполнит
+            error = None if self._task.cancelled() else self._task.exception()
+            logger.error(f"Serialized writer died ({error!r}), restarting")
+            self._fail_pending(error)
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._task = loop.create_task(self._run())
+
+    async def submit(self, bind: AsyncEngine, job: WriteJob) -> Any:
+        self._ensure_started()
+        future = self._loop.create_future()
+        # Задача выполняется в контексте отправителя: ей видны contextvars запроса, например трассировка
+        await self._queue.put((bind, job, future, contextvars.copy_context()))
+        return await future
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _run(self) -> None:
+        while True:
+            bind, job, future, context = await self._queue.get()
+            if future.cancelled():
+                continue
+            task = self._loop.create_task(self._execute(bind, job, future), context=context)
+            # Отправитель перестал ждать (истёк срок запроса): задача откатывается, а не коммитит без него
+            future.add_done_callback(lambda done, task=task: task.cancel() if done.cancelled() else None)
+            try:
+                await asyncio.wait({task})
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+
+    async def _execute(self, bind: AsyncEngine, job: WriteJob, future: asyncio.Future) -> None:
+        try:
+            # Отдельная сессия: запрос мог быть отменён, а его сессия закрыта, пока задача ждала очереди
+            async with AsyncSession(bind, expire_on_commit=False) as session:
+                result = await job(session)
+        except asyncio.CancelledError:
+            if not future.done():
+                future.cancel()
+            raise
+        except BaseException as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+
+    def _fail_pending(self, error: BaseException | None) -> None:
+        while self._queue is not None and not self._queue.empty():
+            _, _, future, _ = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(error or RuntimeError("Serialized writer stopped"))
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Serialized writer stopped with error: {e}")
+        self._fail_pending(None)
+        self._task = None
+
+
+sqlite_writer = SerializedWriter()
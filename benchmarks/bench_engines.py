@@ -0,0 +1,89 @@
+"""Сравнение движков reserve() (orm и procedure) при конкуренции за один товар.
+
+Каждый движок запускается в отдельном процессе с RESERVE_ENGINE=<движок> против
+Postgres из DATABASE_URL. Все запросы бронируют один и тот же товар, поэтому
+пропускная способность упирается во время удержания блокировки строки.
+
+    python benchmarks/bench_engines.py --requests 5000 --concurrency 64
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ENGINES = ("orm", "procedure")
+HOT_PRODUCT_NAME = "bench-hot-sku"
+
+
+async def run_engine(requests: int, concurrency: int) -> None:
+    from httpx import ASGITransport, AsyncClient
+    from sqlalchemy import select
+
+    from app.db import engine, new_session, set_db
+    from app.main import app
+    from app.models import ProductsModel
+    from app.procedures import RESERVE_ENGINE, install_procedures
+
+    await set_db()
+    await install_procedures()
+    async with new_session() as session:
+        product = await session.scalar(select(ProductsModel).where(ProductsModel.product_name == HOT_PRODUCT_NAME))
+        if product is None:
+            product = ProductsModel(product_name=HOT_PRODUCT_NAME, available_quantity=0)
+            session.add(product)
+        product.available_quantity = requests * 2
+        await session.commit()
+        product_id = product.product_id
+
+    payload = {"product_id": product_id, "quantity": 1, "timestamp": "2024-09-04T12:00:00Z"}
+    latencies: list[float] = []
+    remaining = requests
+
+    async with AsyncClient(transport=ASGITransport(app), base_url="http://bench") as client:
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                started = time.perf_counter()
+                response = await client.post("/reservation/reserve", json=payload)
+                latencies.append(time.perf_counter() - started)
+                assert response.status_code == 200, response.text
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    print(f"{RESERVE_ENGINE:>9} {len(latencies) / elapsed:>10.0f} {p50:>9.1f} {p99:>9.1f}")
+    await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--engine", choices=ENGINES)
+    options = parser.parse_args()
+
+    if options.engine:
+        asyncio.run(run_engine(options.requests, options.concurrency))
+        return
+
+    print(f"{'engine':>9} {'rps':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    for name in ENGINES:
+        env = dict(os.environ, RESERVE_ENGINE=name, LOG_LEVEL="WARNING", LOG_FILE_PATH="")
+        subprocess.run(
+            [sys.executable, __file__, "--engine", name,
+             "--requests", str(options.requests), "--concurrency", str(options.concurrency)],
+            env=env, check=True,
+        )
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    main()
@@ -0,0 +1,123 @@
+"""Бронирование горячего товара через леджер в памяти против блокировки строки в базе.
+
+Каждый режим запускается в отдельном процессе против DATABASE_URL: db - обычный
+reserve() с FOR UPDATE, ledger - товар арендован в InventoryLedger, брони
+подтверждаются после fsync журнала и пишутся в базу пачками. Печатаются
+пропускная способность /reservation/reserve, p50/p99 и, для леджера, скорость
+самого InventoryLedger.reserve() без HTTP. Admission control работает с настройками по умолчанию,
+отброшенные им запросы (429/503) печатаются в колонке shed и не входят в rps.
+
+    python benchmarks/bench_ledger.py --requests 5000 --concurrency 64
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+MODES = ("db", "ledger")
+HOT_PRODUCT_NAME = "bench-ledger-sku"
+
+
+async def run_mode(mode: str, requests: int, concurrency: int) -> None:
+    from httpx import ASGITransport, AsyncClient
+    from sqlalchemy import delete, select
+
+    from app.db import engine, new_session, set_db
+    from app.ledger import inventory_ledger
+    from app.main import app
+    from app.models import LedgerLeasesModel, ProductsModel
+
+    await set_db()
+    async with new_session() as session:
+        product = await session.scalar(select(ProductsModel).where(ProductsModel.product_name == HOT_PRODUCT_NAME))
+        if product is None:
+            product = ProductsModel(product_name=HOT_PRODUCT_NAME, available_quantity=0)
+            session.add(product)
+            await session.flush()
+        await session.execute(delete(LedgerLeasesModel).where(LedgerLeasesModel.product_id == product.product_id))
+        product.available_quantity = requests * 3
+        await session.commit()
+        product_id = product.product_id
+
+    if mode == "ledger":
+        await inventory_ledger.start(engine)
+        await inventory_ledger.lease(product_id)
+
+    payload = {"product_id": product_id, "quantity": 1, "timestamp": "2024-09-04T12:00:00Z"}
+    latencies: list[float] = []
+    shed = 0
+    remaining = requests
+
+    async with AsyncClient(transport=ASGITransport(app), base_url="http://bench") as client:
+        async def worker():
+            nonlocal remaining, shed
+            while remaining > 0:
+                remaining -= 1
+                started = time.perf_counter()
+                response = await client.post("/reservation/reserve", json=payload)
+                latencies.append(time.perf_counter() - started)
+                # Admission control включён как в обычном запуске: 429/503 считаются отдельно
+                if response.status_code in (429, 503):
+                    shed += 1
+                else:
+                    assert response.status_code == 200, response.text
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p50 = statistics.median(latencies) * 1000
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    line = f"{mode:>7} {(len(latencies) - shed) / elapsed:>10.0f} {shed:>6} {p50:>9.2f} {p99:>9.2f}"
+
+    if mode == "ledger":
+        # Тот же путь без HTTP: решение в памяти плюс ожидание групповой записи журнала
+        moment = datetime.now(timezone.utc)
+        started = time.perf_counter()
+        await asyncio.gather(*(inventory_ledger.reserve(product_id, 1, moment) for _ in range(requests)))
+        elapsed = time.perf_counter() - started
+        line += f"   ledger.reserve(): {requests / elapsed:.0f}/s, {elapsed / requests * 1e6:.1f} us each"
+
+        started = time.perf_counter()
+        await inventory_ledger.release(product_id)
+        line += f", write-behind tail {time.perf_counter() - started:.2f} s"
+        await inventory_ledger.stop()
+
+    print(line)
+    await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--mode", choices=MODES)
+    options = parser.parse_args()
+
+    if options.mode:
+        asyncio.run(run_mode(options.mode, options.requests, options.concurrency))
+        return
+
+    print(f"{'mode':>7} {'rps':>10} {'shed':>6} {'p50 ms':>9} {'p99 ms':>9}")
+    with tempfile.TemporaryDirectory() as journal_dir:
+        for mode in MODES:
+            env = dict(
+                os.environ, INVENTORY_LEDGER=str(mode == "ledger").lower(), LEDGER_JOURNAL_DIR=journal_dir,
+                TRACE_SAMPLE_RATE="0", LOG_LEVEL="WARNING", LOG_FILE_PATH="",
+            )
+            subprocess.run(
+                [sys.executable, __file__, "--mode", mode,
+                 "--requests", str(options.requests), "--concurrency", str(options.concurrency)],
+                env=env, check=True,
+            )
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    main()
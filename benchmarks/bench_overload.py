@@ -0,0 +1,119 @@
+"""Нагрузка в 5 раз выше пропускной способности с admission control и без него.
+
+Сначала замкнутым циклом измеряется пропускная способность /reservation/reserve,
+затем запросы поступают открытым потоком (пуассоновский процесс) с частотой
+--overload x capacity. Печатаются p50/p99 принятых запросов и доля сброшенных.
+
+    python benchmarks/bench_overload.py --duration 10 --overload 5
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+
+HOT_PRODUCTS = 4
+COLD_PRODUCTS = 200
+
+
+def percentile(values: list[float], share: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+async def run(duration: float, overload: float) -> None:
+    from httpx import ASGITransport, AsyncClient
+    from sqlalchemy import delete
+
+    from app.admission import ADMISSION_CONTROL, ADMISSION_MAX_CONCURRENCY
+    from app.db import engine, new_session, set_db
+    from app.main import app
+    from app.models import ProductsModel, ReservationsModel
+
+    await set_db()
+    product_ids = list(range(1_000_001, 1_000_001 + HOT_PRODUCTS + COLD_PRODUCTS))
+    async with new_session() as session:
+        await session.execute(delete(ReservationsModel).where(ReservationsModel.product_id.in_(product_ids)))
+        await session.execute(delete(ProductsModel).where(ProductsModel.product_id.in_(product_ids)))
+        session.add_all(
+            ProductsModel(product_id=product_id, product_name=f"bench-{product_id}", available_quantity=10**9)
+            for product_id in product_ids
+        )
+        await session.commit()
+
+    def payload() -> dict:
+        # Половина трафика приходится на несколько горячих товаров
+        if random.random() < 0.5:
+            product_id = random.choice(product_ids[:HOT_PRODUCTS])
+        else:
+            product_id = random.choice(product_ids[HOT_PRODUCTS:])
+        return {"product_id": product_id, "quantity": 1, "timestamp": "2024-09-04T12:00:00Z"}
+
+    async with AsyncClient(transport=ASGITransport(app), base_url="http://bench", timeout=120) as client:
+        done = 0
+        deadline = time.perf_counter() + duration / 2
+
+        async def closed_loop():
+            nonlocal done
+            while time.perf_counter() < deadline:
+                await client.post("/reservation/reserve", json=payload())
+                done += 1
+
+        await asyncio.gather(*(closed_loop() for _ in range(ADMISSION_MAX_CONCURRENCY)))
+        capacity = done / (duration / 2)
+
+        rate = capacity * overload
+        latencies: list[float] = []
+        statuses: dict[int, int] = {}
+
+        async def one():
+            started = time.perf_counter()
+            response = await client.post("/reservation/reserve", json=payload())
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if response.status_code == 200:
+                latencies.append(time.perf_counter() - started)
+
+        tasks = []
+        stop_at = time.perf_counter() + duration
+        while time.perf_counter() < stop_at:
+            tasks.append(asyncio.create_task(one()))
+            await asyncio.sleep(random.expovariate(rate))
+        await asyncio.gather(*tasks)
+
+    total = sum(statuses.values())
+    shed = total - statuses.get(200, 0)
+    print(
+        f"admission={'on' if ADMISSION_CONTROL else 'off':>3} capacity={capacity:.0f} rps offered={rate:.0f} rps "
+        f"admitted p50={percentile(latencies, 0.5) * 1000:.1f} ms p99={percentile(latencies, 0.99) * 1000:.1f} ms "
+        f"shed={shed / total:.1%} statuses={dict(sorted(statuses.items()))}"
+    )
+    await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--overload", type=float, default=5)
+    parser.add_argument("--single", action="store_true")
+    options = parser.parse_args()
+
+    if options.single:
+        asyncio.run(run(options.duration, options.overload))
+        return
+
+    for enabled in ("false", "true"):
+        env = dict(os.environ, ADMISSION_CONTROL=enabled, LOG_LEVEL="ERROR", LOG_FILE_PATH="")
+        subprocess.run(
+            [sys.executable, __file__, "--single",
+             "--duration", str(options.duration), "--overload", str(options.overload)],
+            env=env, check=True,
+        )
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    main()
@@ -0,0 +1,105 @@
+"""Масштабирование по воркерам на смеси с преобладанием чтения.
+
+Запускает uvicorn с WEB_CONCURRENCY=1..N против базы из DATABASE_URL (Postgres),
+нагружает его несколькими клиентскими процессами и печатает RPS и эффективность
+относительно одного воркера.
+
+    python benchmarks/bench_workers.py --max-workers 4 --duration 20
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+PORT = 8765
+BASE_URL = f"http://127.0.0.1:{PORT}"
+
+
+async def _client_loop(duration: float, concurrency: int, read_ratio: float, product_ids: list[int]) -> int:
+    done = 0
+    deadline = time.perf_counter() + duration
+
+    async with httpx.AsyncClient(base_url=BASE_URL, timeout=30) as client:
+        async def worker():
+            nonlocal done
+            while time.perf_counter() < deadline:
+                product_id = random.choice(product_ids)
+                if random.random() < read_ratio:
+                    await client.get(f"/products/{product_id}")
+                else:
+                    await client.post("/reservation/reserve", json={
+                        "product_id": product_id,
+                        "quantity": 1,
+                        "timestamp": "2024-09-04T12:00:00Z",
+                    })
+                done += 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return done
+
+
+def _client_process(args, queue) -> None:
+    queue.put(asyncio.run(_client_loop(*args)))
+
+
+def _wait_ready(timeout: float = 30) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(f"{BASE_URL}/products/1", timeout=1)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+def run(workers: int, options) -> float:
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), LOG_LEVEL="WARNING", LOG_FILE_PATH="")
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(PORT), "--no-access-log"],
+        env=env,
+    )
+    try:
+        _wait_ready()
+        httpx.get(f"{BASE_URL}/seed-data")
+        queue = multiprocessing.Queue()
+        args = (options.duration, options.concurrency, options.read_ratio, list(range(1, 7)))
+        clients = [multiprocessing.Process(target=_client_process, args=(args, queue))
+                   for _ in range(options.clients)]
+        for process in clients:
+            process.start()
+        total = sum(queue.get() for _ in clients)
+        for process in clients:
+            process.join()
+        return total / options.duration
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--read-ratio", type=float, default=0.95)
+    options = parser.parse_args()
+
+    baseline = None
+    print(f"{'workers':>7} {'rps':>10} {'speedup':>8} {'efficiency':>10}")
+    for workers in range(1, options.max_workers + 1):
+        rps = run(workers, options)
+        baseline = baseline or rps
+        speedup = rps / baseline
+        print(f"{workers:>7} {rps:>10.0f} {speedup:>8.2f} {speedup / workers:>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Профиль CPU горячего пути /reservation/reserve.
+
+Гоняет последовательные бронирования через ASGI-транспорт против DATABASE_URL
+и печатает процессорное время Python на одно бронирование и топ функций.
+
+    DATABASE_URL=sqlite+aiosqlite:///./profile.db python benchmarks/profile_reserve.py -n 2000
+"""
+import argparse
+import asyncio
+import cProfile
+import os
+import pstats
+import sys
+import time
+
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("LOG_FILE_PATH", "")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from httpx import ASGITransport, AsyncClient  # noqa: E402
+
+from app.db import Base, engine, new_session  # noqa: E402
+from app.main import app  # noqa: E402
+from app.models import ProductsModel  # noqa: E402
+
+PAYLOAD = {"product_id": 1, "quantity": 1, "timestamp": "2024-09-04T12:00:00Z"}
+
+
+async def prepare(count: int) -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with new_session() as session:
+        session.add(ProductsModel(product_id=1, product_name="Profiled Product", available_quantity=count * 2))
+        await session.commit()
+
+
+async def reserve_many(client: AsyncClient, count: int) -> None:
+    for _ in range(count):
+        response = await client.post("/reservation/reserve", json=PAYLOAD)
+        assert response.status_code == 200, response.text
+
+
+async def main(count: int, top: int) -> None:
+    await prepare(count + 100)
+    async with AsyncClient(transport=ASGITransport(app), base_url="http://bench") as client:
+        await reserve_many(client, 100)
+
+        profiler = cProfile.Profile()
+        cpu_started = time.process_time()
+        wall_started = time.perf_counter()
+        profiler.enable()
+        await reserve_many(client, count)
+        profiler.disable()
+        cpu = time.process_time() - cpu_started
+        wall = time.perf_counter() - wall_started
+
+    print(f"reservations: {count}")
+    print(f"cpu per reservation: {cpu / count * 1e6:.0f} us, wall per reservation: {wall / count * 1e6:.0f} us")
+    pstats.Stats(profiler).sort_stats("tottime").print_stats(top)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--count", type=int, default=2000)
+    parser.add_argument("--top", type=int, default=15)
+    options = parser.parse_args()
+    asyncio.run(main(options.count, options.top))
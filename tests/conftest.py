@@ -1,12 +1,18 @@
+import asyncio
 import pytest_asyncio
 import os
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from httpx import AsyncClient, ASGITransport
+from sqlalchemy.engine import make_url
 from sqlalchemy.pool import NullPool
 from dotenv import load_dotenv
 from app.main import app
 
-from app.db import Base, get_db
+from app.db import Base, configure_sqlite, get_db
+from app.cache import product_cache
+from app.notifications import StockListener
+from app.tracing import instrument
 
 load_dotenv()
 
@@ -14,11 +20,21 @@ TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
 if not TEST_DATABASE_URL:
     TEST_DATABASE_URL = "postgresql+asyncpg://user:password@db:5432/mydb_test"
 
-test_engine = create_async_engine(
-    TEST_DATABASE_URL,
-    poolclass=NullPool,
-    echo=False
-)
+TEST_ON_SQLITE = make_url(TEST_DATABASE_URL).get_backend_name() == "sqlite"
+
+if TEST_ON_SQLITE:
+    # Файл SQLite в WAL: соединения держим в пуле, а схему создаём один раз и только очищаем между тестами
+    test_engine = create_async_engine(TEST_DATABASE_URL, echo=False)
+    configure_sqlite(test_engine)
+else:
+    test_engine = create_async_engine(
+        TEST_DATABASE_URL,
+        poolclass=NullPool,
+        echo=False
+    )
+
+# Тайминги запросов для трассировки и лога медленных запросов, как у engine приложения
+instrument(test_engine.sync_engine)
 
 test_session_maker = async_sessionmaker(
     test_engine,
@@ -41,7 +57,11 @@ async def setup_database():
     yield
 
     async with test_engine.begin() as connection:
-        await connection.run_sync(Base.metadata.drop_all)
+        if TEST_ON_SQLITE:
+            for table in reversed(Base.metadata.sorted_tables):
+                await connection.execute(table.delete())
+        else:
+            await connection.run_sync(Base.metadata.drop_all)
         await connection.commit()
 
 
@@ -54,13 +74,31 @@ async def db_session(setup_database):
 @pytest_asyncio.fixture(scope="function")
 async def client():
     app.dependency_overrides[get_db] = get_override_db
+    product_cache.clear()
+
+    # ASGITransport не выполняет lifespan, слушатель NOTIFY тестовой базы запускается здесь
+    listener = None if TEST_ON_SQLITE else StockListener(TEST_DATABASE_URL)
+    if listener is not None:
+        listener.start()
+        await asyncio.wait_for(listener.ready.wait(), 5)
 
     async with AsyncClient(transport=ASGITransport(app), base_url="http://test") as ac:
         yield ac
 
+    if listener is not None:
+        await listener.stop()
     app.dependency_overrides.clear()
 
 
+async def sync_product_id_sequence(session: AsyncSession) -> None:
+    # Явные product_id не сдвигают SERIAL в Postgres, и следующая вставка получила бы занятый id
+    if not TEST_ON_SQLITE:
+        await session.execute(text(
+            "SELECT setval(pg_get_serial_sequence('products', 'product_id'), (SELECT max(product_id) FROM products))"
+        ))
+        await session.commit()
+
+
 @pytest_asyncio.fixture
 async def sample_product(db_session):
     from app.models import ProductsModel
@@ -72,6 +110,7 @@ async def sample_product(db_session):
     )
     db_session.add(product)
     await db_session.commit()
+    await sync_product_id_sequence(db_session)
     await db_session.refresh(product)
 
     return product
@@ -91,6 +130,7 @@ async def multiple_products(db_session):
     ]
     db_session.add_all(products)
     await db_session.commit()
+    await sync_product_id_sequence(db_session)
 
     for product in products:
         await db_session.refresh(product)
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from app.admission import AdmissionController, Overloaded
+
+
+@pytest.mark.asyncio
+async def test_product_queue_overflow_is_shed_with_429():
+    controller = AdmissionController(max_concurrency=10, product_concurrency=1, product_queue_size=1, max_wait_ms=1000)
+    release = asyncio.Event()
+
+    async def hold():
+        async with controller.admit(1):
+            await release.wait()
+
+    holder = asyncio.create_task(hold())
+    waiter = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    assert controller.queue_depth == 1
+
+    with pytest.raises(Overloaded) as exc_info:
+        async with controller.admit(1):
+            pass
+    assert exc_info.value.status_code == 429
+
+    # Другие товары не ждут горячий
+    async with controller.admit(2):
+        pass
+
+    release.set()
+    await asyncio.gather(holder, waiter)
+    assert controller.product_gates == {}
+    assert controller.global_gate.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_global_wait_past_deadline_is_shed_with_503():
+    controller = AdmissionController(max_concurrency=1, product_concurrency=5, max_wait_ms=20)
+    release = asyncio.Event()
+
+    async def hold():
+        async with controller.admit(1):
+            await release.wait()
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+
+    with pytest.raises(Overloaded) as exc_info:
+        async with controller.admit(2):
+            pass
+    assert exc_info.value.status_code == 503
+    assert exc_info.value.retry_after > 0
+
+    release.set()
+    await holder
+    assert controller.queue_depth == 0
+
+
+@pytest.mark.asyncio
+async def test_disabled_controller_admits_everything():
+    controller = AdmissionController(max_concurrency=1, product_queue_size=0, enabled=False)
+
+    async with controller.admit(1):
+        async with controller.admit(1):
+            pass
+
+
+@pytest.mark.asyncio
+async def test_reserve_shed_returns_retry_after(client, sample_product, monkeypatch):
+    from app import routes
+
+    controller = AdmissionController(max_concurrency=1, product_concurrency=1, product_queue_size=0)
+    monkeypatch.setattr(routes, "admission_controller", controller)
+    payload = {
+        "product_id": 1,
+        "quantity": 1,
+        "timestamp": "2024-09-04T12:00:00Z"
+    }
+
+    async with controller.admit(1):
+        response = await client.post("/reservation/reserve", json=payload)
+
+    assert response.status_code == 429
+    assert response.json()["detail"]["status"] == "error"
+    assert int(response.headers["Retry-After"]) >= 1
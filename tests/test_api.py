@@ -408,6 +408,8 @@ async def test_seed_data_error_handling_on_commit(client, db_session):
     mock_session.execute = AsyncMock(return_value=mock_result)
     mock_session.add_all = MagicMock()
     mock_session.flush = AsyncMock()
+    mock_session.get_bind = MagicMock()
+    mock_session.get_bind.return_value.dialect.name = "postgresql"
 
     async def failing_commit():
         raise Exception("Database commit failed")
@@ -424,6 +426,7 @@ async def test_seed_data_error_handling_on_commit(client, db_session):
     assert "Ошибка при заполнении базы данных" in str(exc_info.value.detail)
     
     # Проверяем что rollback был вызван
+    mock_session.commit.assert_awaited_once()
     mock_session.rollback.assert_called_once()
 
 
@@ -515,3 +518,133 @@ async def test_reserve_creates_reservation_with_correct_status(client, db_sessio
     assert reservation.status.value == "completed"
 
 
+@pytest.mark.asyncio
+async def test_get_product(client, sample_product):
+    response = await client.get(f"/products/{sample_product.product_id}")
+    data = response.json()
+
+    assert response.status_code == 200
+    assert data["product_name"] == "Test Product"
+    assert data["available_quantity"] == 100
+
+
+@pytest.mark.asyncio
+async def test_get_product_not_found(client, db_session):
+    response = await client.get("/products/99999")
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_get_product_cache_invalidated_by_reserve(client, sample_product):
+    response = await client.get("/products/1")
+    assert response.json()["available_quantity"] == 100
+
+    payload = {
+        "product_id": 1,
+        "quantity": 10,
+        "timestamp": "2024-09-04T12:00:00Z"
+    }
+    response = await client.post("/reservation/reserve", json=payload)
+    assert response.status_code == 200
+
+    response = await client.get("/products/1")
+    assert response.json()["available_quantity"] == 90
+
+
+@pytest.mark.asyncio
+async def test_metrics_exposes_cache_hit_rates(client):
+    response = await client.get("/metrics")
+    data = response.json()
+
+    assert response.status_code == 200
+    assert "sql.compile_cache.hit_rate" in data
+    assert "sql.prepared_cache.hit_rate" in data
+
+
+def test_prepare_hot_path_continues_after_failed_statement(monkeypatch):
+    """Соединение, открытое до install_procedures, готовит остальные запросы горячего пути"""
+    from app import queries
+    from sqlalchemy.dialects.postgresql.asyncpg import PGDialect_asyncpg
+    from unittest.mock import MagicMock
+
+    monkeypatch.setattr(queries, "engine", MagicMock(sync_engine=MagicMock(dialect=PGDialect_asyncpg())))
+    cache = {}
+    attempts = []
+
+    def prepare(sql, invalidate_asof):
+        attempts.append(sql)
+        if len(attempts) == 1:
+            raise RuntimeError("function reserve_product does not exist")
+        cache[sql] = ("prepared", invalidate_asof)
+
+    connection = MagicMock(
+        _prepare=prepare, _invalidate_schema_cache_asof=0, _prepared_statement_cache=cache, await_=lambda result: result
+    )
+    queries.prepare_hot_path(connection, None)
+
+    # Запросы попадают в кэш адаптера, из которого их берёт execute
+    assert len(attempts) == len(queries.HOT_PATH_STATEMENTS)
+    assert list(cache) == attempts[1:]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("outcome, status_code", [("not_found", 404), ("insufficient_stock", 400)])
+async def test_reserve_with_procedure_maps_outcome(outcome, status_code):
+    """Ответы движка на хранимой процедуре совпадают с ORM-реализацией"""
+    from app.routes import reserve_with_procedure
+    from app.schema import Reservation
+    from fastapi import HTTPException
+    from unittest.mock import AsyncMock, MagicMock
+
+    mock_result = MagicMock()
+    mock_result.one = MagicMock(return_value=(outcome, None, None))
+    mock_session = AsyncMock()
+    mock_session.execute = AsyncMock(return_value=mock_result)
+
+    reservation = Reservation(product_id=1, quantity=10, timestamp="2024-09-04T12:00:00Z")
+    with pytest.raises(HTTPException) as exc_info:
+        await reserve_with_procedure(mock_session, reservation)
+
+    assert exc_info.value.status_code == status_code
+    assert exc_info.value.detail["status"] == "error"
+
+
+@pytest.mark.asyncio
+async def test_reserve_with_procedure_success():
+    from app.routes import reserve_with_procedure
+    from app.schema import Reservation
+    from unittest.mock import AsyncMock, MagicMock
+
+    mock_result = MagicMock()
+    mock_result.one = MagicMock(return_value=("ok", 42, 90))
+    mock_session = AsyncMock()
+    mock_session.execute = AsyncMock(return_value=mock_result)
+    mock_session.info = {}
+
+    reservation = Reservation(product_id=1, quantity=10, timestamp="2024-09-04T12:00:00Z")
+    assert await reserve_with_procedure(mock_session, reservation) == 42
+    mock_session.commit.assert_called_once()
+    # Остаток раздаётся подписчикам своего процесса после commit, не дожидаясь NOTIFY
+    assert mock_session.info["stock_changes"] == [(1, 90)]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_reservations_do_not_oversell(client, db_session, sample_product):
+    import asyncio
+
+    payload = {
+        "product_id": 1,
+        "quantity": 5,
+        "timestamp": "2024-09-04T12:00:00Z"
+    }
+
+    responses = await asyncio.gather(*(client.post("/reservation/reserve", json=payload) for _ in range(25)))
+    status_codes = sorted(response.status_code for response in responses)
+
+    assert status_codes == [200] * 20 + [400] * 5
+
+    result = await db_session.execute(
+        select(ProductsModel.available_quantity)
+        .where(ProductsModel.product_id == sample_product.product_id)
+    )
+    assert result.scalar_one() == 0
@@ -0,0 +1,55 @@
+import pytest
+
+from app.contention import ContentionProfiler, SpaceSaving
+
+
+def test_space_saving_is_bounded_and_keeps_heavy_hitters():
+    heavy_hitters = SpaceSaving(capacity=4)
+
+    for _ in range(100):
+        heavy_hitters.add(1, 10.0)
+        heavy_hitters.add(2, 5.0)
+    for product_id in range(100, 1100):
+        heavy_hitters.add(product_id, 0.1)
+
+    assert len(heavy_hitters) == 4
+    assert [item.product_id for item in heavy_hitters.top(2)] == [1, 2]
+
+
+def test_space_saving_inherits_evicted_weight_as_error():
+    heavy_hitters = SpaceSaving(capacity=1)
+    heavy_hitters.add(1, 3.0)
+    item = heavy_hitters.add(2, 1.0)
+
+    assert item.weight == 4.0
+    assert item.error == 3.0
+
+
+def test_profiler_rotates_windows():
+    profiler = ContentionProfiler(enabled=True)
+    profiler.record(7, lock_wait=0.2, lock_hold=0.01)
+    profiler.record(7, lock_wait=0.4, lock_hold=0.01)
+
+    previous = profiler.rotate()
+    item = previous.heavy_hitters.top(1)[0]
+    assert item.reservations == 2
+    assert item.max_lock_wait_seconds == 0.4
+    assert profiler.report()["current"]["products"] == []
+    assert profiler.report()["previous"]["products"][0]["product_id"] == 7
+
+
+@pytest.mark.asyncio
+async def test_contention_endpoint_reports_reserved_product(client, sample_product):
+    payload = {
+        "product_id": 1,
+        "quantity": 1,
+        "timestamp": "2024-09-04T12:00:00Z"
+    }
+    response = await client.post("/reservation/reserve", json=payload)
+    assert response.status_code == 200
+
+    response = await client.get("/admin/contention")
+    data = response.json()
+
+    assert response.status_code == 200
+    assert 1 in [item["product_id"] for item in data["current"]["products"]]
@@ -14,3 +14,77 @@ async def test_database_connection(sample_product, db_session):
     product_id_db = await db_session.get(ProductsModel, sample_product.product_id)
     assert product_id_db is not None
     assert product_id_db.product_name == "Test Product"
+
+
+def test_worker_pool_size_divides_connection_budget():
+    from app.db import worker_pool_size
+
+    assert worker_pool_size(20, 1) == 19
+    assert worker_pool_size(20, 4) == 4
+    assert worker_pool_size(4, 2) == 1
+    with pytest.raises(ValueError):
+        worker_pool_size(4, 8)
+
+
+def test_product_cache_skips_stale_set():
+    from app.cache import ProductCache
+
+    cache = ProductCache(max_size=2)
+    generation = cache.generation()
+    cache.invalidate(1)
+    cache.set(1, "stale", generation)
+    assert cache.get(1) is None
+
+    # Изменение другого товара не отменяет заполнение
+    generation = cache.generation()
+    cache.invalidate(2)
+    cache.set(1, "fresh", generation)
+    assert cache.get(1) == "fresh"
+    cache.clear()
+
+    cache.set(1, "a")
+    cache.set(2, "b")
+    cache.set(3, "c")
+    assert len(cache) == 2
+    assert cache.get(1) is None
+
+
+@pytest.mark.asyncio
+async def test_sqlite_uses_wal(db_session):
+    from sqlalchemy import text
+
+    if db_session.bind.dialect.name != "sqlite":
+        pytest.skip("SQLite-only")
+
+    result = await db_session.execute(text("PRAGMA journal_mode"))
+    assert result.scalar_one() == "wal"
+
+
+@pytest.mark.asyncio
+async def test_writer_restart_fails_orphaned_jobs():
+    import asyncio
+    from app.writer import SerializedWriter
+
+    writer = SerializedWriter()
+    started = asyncio.Event()
+
+    async def blocking(session):
+        started.set()
+        await asyncio.Event().wait()
+
+    first = asyncio.ensure_future(writer.submit(None, blocking))
+    await started.wait()
+    second = asyncio.ensure_future(writer.submit(None, lambda session: asyncio.sleep(0)))
+    await asyncio.sleep(0)
+
+    # Писатель умер с задачей в очереди, следующий submit перезапускает его
+    writer._task.cancel()
+    await asyncio.gather(first, return_exceptions=True)
+
+    async def job(session):
+        return "done"
+
+    assert await writer.submit(None, job) == "done"
+    with pytest.raises(RuntimeError):
+        await second
+    await writer.stop()
@@ -0,0 +1,167 @@
+import asyncio
+
+import pytest
+from starlette.requests import Request
+
+from app.deadlines import Deadline, request_deadline, run_until_deadline
+
+
+def make_request(headers: dict) -> Request:
+    return Request({
+        "type": "http",
+        "method": "POST",
+        "path": "/reservation/reserve",
+        "headers": [(key.lower().encode(), value.encode()) for key, value in headers.items()],
+    })
+
+
+class FakeRequest:
+    def __init__(self, disconnected: bool = False):
+        self.disconnected = disconnected
+
+    async def is_disconnected(self) -> bool:
+        return self.disconnected
+
+
+def test_request_deadline_from_header():
+    deadline = request_deadline(make_request({"X-Request-Timeout-Ms": "250"}))
+    assert deadline.timeout == 0.25
+
+
+def test_request_deadline_ignores_malformed_header():
+    from app.deadlines import REQUEST_TIMEOUT_MS
+
+    deadline = request_deadline(make_request({"X-Request-Timeout-Ms": "soon"}))
+    assert deadline.timeout == REQUEST_TIMEOUT_MS / 1000
+
+
+def test_expired_deadline_keeps_postgres_timeout_enabled():
+    deadline = Deadline(0)
+    assert deadline.remaining() == 0
+    assert deadline.remaining_ms() == 1
+
+
+@pytest.mark.asyncio
+async def test_run_until_deadline_cancels_work_on_timeout():
+    from fastapi import HTTPException
+
+    cancelled = asyncio.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with pytest.raises(HTTPException) as exc_info:
+        await run_until_deadline(FakeRequest(), Deadline(0.05), slow())
+
+    assert exc_info.value.status_code == 504
+    assert cancelled.is_set()
+
+
+@pytest.mark.asyncio
+async def test_run_until_deadline_cancels_work_on_disconnect():
+    from fastapi import HTTPException
+
+    with pytest.raises(HTTPException) as exc_info:
+        await run_until_deadline(FakeRequest(disconnected=True), Deadline(5), asyncio.sleep(10))
+
+    assert exc_info.value.status_code == 499
+
+
+@pytest.mark.asyncio
+async def test_run_until_deadline_returns_result():
+    async def fast():
+        return 42
+
+    assert await run_until_deadline(FakeRequest(), Deadline(1), fast()) == 42
+
+
+@pytest.mark.asyncio
+async def test_reserve_timeout_returns_504(client, sample_product, monkeypatch):
+    from app import routes
+
+    async def stuck(*args):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(routes, "reserve_with_engine", lambda *args: stuck())
+    payload = {
+        "product_id": 1,
+        "quantity": 1,
+        "timestamp": "2024-09-04T12:00:00Z"
+    }
+
+    response = await client.post("/reservation/reserve", json=payload, headers={"X-Request-Timeout-Ms": "50"})
+
+    assert response.status_code == 504
+    assert response.json()["detail"]["status"] == "error"
+    assert response.json()["detail"]["code"] == "timeout"
+
+
+@pytest.mark.asyncio
+async def test_run_until_deadline_waits_for_started_commit():
+    deadline = Deadline(0.02)
+
+    async def committing():
+        deadline.start_commit()
+        await asyncio.sleep(0.1)
+        return 42
+
+    assert await run_until_deadline(FakeRequest(), deadline, committing()) == 42
+
+
+@pytest.mark.asyncio
+async def test_run_until_deadline_reports_unknown_outcome(monkeypatch):
+    from fastapi import HTTPException
+    from app import deadlines
+
+    monkeypatch.setattr(deadlines, "DEADLINE_COMMIT_GRACE_MS", 10)
+    deadline = Deadline(0.02)
+    committed = asyncio.Event()
+
+    async def committing():
+        deadline.start_commit()
+        await asyncio.sleep(0.1)
+        committed.set()
+
+    with pytest.raises(HTTPException) as exc_info:
+        await run_until_deadline(FakeRequest(), deadline, committing())
+
+    assert exc_info.value.status_code == 504
+    assert exc_info.value.detail["code"] == "outcome_unknown"
+    # Начатый commit не отменяется и доходит до конца в фоне
+    await asyncio.wait_for(committed.wait(), 1)
+
+
+@pytest.mark.asyncio
+async def test_reserve_timeout_in_writer_rolls_back(client, db_session, sample_product, monkeypatch):
+    from sqlalchemy import func, select
+    from app import routes
+    from app.models import ProductsModel, ReservationsModel
+
+    if db_session.bind.dialect.name != "sqlite":
+        pytest.skip("SQLite-only")
+
+    record_reservation_stats = routes.record_reservation_stats
+
+    async def slow_stats(*args):
+        await asyncio.sleep(0.3)
+        await record_reservation_stats(*args)
+
+    monkeypatch.setattr(routes, "record_reservation_stats", slow_stats)
+    payload = {
+        "product_id": 1,
+        "quantity": 1,
+        "timestamp": "2024-09-04T12:00:00Z"
+    }
+
+    response = await client.post("/reservation/reserve", json=payload, headers={"X-Request-Timeout-Ms": "50"})
+    assert response.status_code == 504
+    await asyncio.sleep(0.4)
+
+    # Задача последовательного писателя отменена вместе с запросом и не закоммитила списание
+    db_session.expire_all()
+    assert await db_session.scalar(select(ProductsModel.available_quantity)) == 100
+    assert await db_session.scalar(select(func.count(ReservationsModel.reservation_id))) == 0
@@ -0,0 +1,129 @@
+import pytest
+from sqlalchemy import select
+
+from app.importer import iter_records
+from app.models import ProductsModel
+
+
+async def as_chunks(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+@pytest.mark.asyncio
+async def test_iter_records_handles_split_chunks_and_quoted_newlines():
+    data = 'product_name,quantity\r\n"Multi\nline",5\nПланшет,7'.encode()
+
+    records = [record async for record in iter_records(as_chunks(data, 3))]
+
+    assert records == [
+        (1, ["product_name", "quantity"]),
+        (2, ["Multi\nline", "5"]),
+        (4, ["Планшет", "7"]),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_import_adds_stock_and_creates_products(client, db_session, sample_product):
+    csv_body = (
+        "product_name,quantity\n"
+        "Test Product,50\n"
+        "New Product,20\n"
+        "New Product,5\n"
+        "Broken Product,many\n"
+        ",3\n"
+    )
+
+    response = await client.post("/products/import", content=csv_body, headers={"Content-Type": "text/csv"})
+    data = response.json()
+
+    assert response.status_code == 200
+    assert data["rows_total"] == 5
+    assert data["products_updated"] == 1
+    assert data["products_created"] == 1
+    assert data["rows_rejected"] == 2
+    assert len(data["errors"]) == 2
+
+    result = await db_session.execute(select(ProductsModel.product_name, ProductsModel.available_quantity))
+    assert dict(result.all()) == {"Test Product": 150, "New Product": 25}
+
+
+@pytest.mark.asyncio
+async def test_import_set_mode_and_small_chunks(client, db_session, multiple_products):
+    csv_body = "quantity,product_name\n" + "".join(f"{i},Test Product {i}\n" for i in range(6))
+
+    response = await client.post("/products/import?mode=set", content=csv_body)
+    data = response.json()
+
+    assert response.status_code == 200
+    assert data["products_updated"] == 6
+
+    result = await db_session.execute(select(ProductsModel.product_id, ProductsModel.available_quantity))
+    assert dict(result.all()) == {i: i for i in range(6)}
+
+
+@pytest.mark.asyncio
+async def test_import_invalidates_product_cache(client, sample_product):
+    response = await client.get("/products/1")
+    assert response.json()["available_quantity"] == 100
+
+    response = await client.post("/products/import", content="product_name,quantity\nTest Product,1\n")
+    assert response.status_code == 200
+
+    response = await client.get("/products/1")
+    assert response.json()["available_quantity"] == 101
+
+
+@pytest.mark.asyncio
+async def test_import_rejects_missing_columns(client, db_session):
+    response = await client.post("/products/import", content="name,qty\nA,1\n")
+
+    assert response.status_code == 400
+    assert "product_name" in response.json()["detail"]["message"]
+
+
+@pytest.mark.asyncio
+async def test_import_rejects_quantities_beyond_integer(client, db_session, sample_product):
+    csv_body = (
+        "product_name,quantity\n"
+        "Test Product,2147483648\n"
+        "New Product,2147483647\n"
+        "New Product,1\n"
+    )
+
+    response = await client.post("/products/import", content=csv_body)
+    data = response.json()
+
+    assert response.status_code == 200
+    assert data["rows_rejected"] == 2
+    assert data["products_created"] == 1
+
+    result = await db_session.execute(select(ProductsModel.product_name, ProductsModel.available_quantity))
+    assert dict(result.all()) == {"Test Product": 100, "New Product": 2147483647}
+
+
+@pytest.mark.asyncio
+async def test_import_rejects_products_the_database_refuses(client, db_session, sample_product, monkeypatch):
+    from sqlalchemy.exc import DataError
+
+    from app import importer
+
+    apply_chunk = importer.apply_chunk
+
+    async def overflowing_apply_chunk(session, rows, mode):
+        # Так Postgres отвечает на сумму add, вышедшую за INTEGER
+        if "Test Product" in rows:
+            raise DataError("UPDATE products", {}, Exception("integer out of range"))
+        return await apply_chunk(session, rows, mode)
+
+    monkeypatch.setattr(importer, "apply_chunk", overflowing_apply_chunk)
+    response = await client.post("/products/import", content="product_name,quantity\nTest Product,5\nNew Product,3\n")
+    data = response.json()
+
+    assert response.status_code == 200
+    assert data["products_created"] == 1
+    assert data["rows_rejected"] == 1
+    assert data["errors"] == ["product 'Test Product': rejected by the database: integer out of range"]
+
+    result = await db_session.execute(select(ProductsModel.product_name, ProductsModel.available_quantity))
+    assert dict(result.all()) == {"Test Product": 100, "New Product": 3}
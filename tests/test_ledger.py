@@ -0,0 +1,229 @@
+import asyncio
+import os
+import threading
+from datetime import datetime, timezone
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import func, select
+
+from app import routes
+from app.ledger import InventoryLedger, NotLeased
+from app.models import LedgerLeasesModel, ProductsModel, ReservationStatsModel, ReservationsModel
+
+MOMENT = datetime(2024, 9, 4, 12, 0, tzinfo=timezone.utc)
+
+
+def make_ledger(journal_dir) -> InventoryLedger:
+    # Фоновая запись выключена длинным интервалом, тесты сбрасывают леджер явно
+    return InventoryLedger(journal_dir=str(journal_dir), flush_interval=3600, id_block_size=10)
+
+
+@pytest_asyncio.fixture
+async def ledger(db_session, sample_product, tmp_path):
+    ledger = make_ledger(tmp_path)
+    await ledger.start(db_session.bind)
+    yield ledger
+    await ledger.stop()
+
+
+async def crash(ledger: InventoryLedger) -> None:
+    # Процесс умер: фоновые задачи останавливаются, в базу ничего не досылается
+    for task in (ledger._task, ledger._refill, ledger.journal._task):
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+    ledger.journal._file.close()
+
+
+async def db_state(db_session) -> tuple[int, int | None, list[int], int]:
+    db_session.expire_all()
+    available = await db_session.scalar(select(ProductsModel.available_quantity).where(ProductsModel.product_id == 1))
+    leased = await db_session.scalar(select(LedgerLeasesModel.quantity).where(LedgerLeasesModel.product_id == 1))
+    ids = list(await db_session.scalars(select(ReservationsModel.reservation_id).order_by(ReservationsModel.reservation_id)))
+    stats = await db_session.scalar(select(func.coalesce(func.sum(ReservationStatsModel.quantity_total), 0)))
+    return available, leased, ids, stats
+
+
+@pytest.mark.asyncio
+async def test_crash_recovery_replays_acknowledged_reservations(db_session, sample_product, tmp_path):
+    ledger = make_ledger(tmp_path)
+    await ledger.start(db_session.bind)
+    assert await ledger.lease(1) == 100
+    assert await db_state(db_session) == (0, 100, [], 0)
+
+    first = await ledger.reserve(1, 10, MOMENT)
+    flushed_segment = ledger.journal.segments()[0]
+    with open(flushed_segment, "rb") as segment:
+        flushed_record = segment.read()
+    assert await ledger.flush() == 1
+    second = await ledger.reserve(1, 20, MOMENT)
+    third = await ledger.reserve(1, 5, MOMENT)
+    assert ledger.available(1) == 65
+
+    # Падение между коммитом пачки и удалением её сегмента и недописанная последняя строка
+    with open(flushed_segment, "wb") as segment:
+        segment.write(flushed_record)
+    with open(ledger.journal.segments()[-1], "ab") as segment:
+        segment.write(b'{"reservation_id": 999, "product_')
+    await crash(ledger)
+    assert await db_state(db_session) == (0, 90, [first], 10)
+
+    recovered = make_ledger(tmp_path)
+    await recovered.start(db_session.bind)
+
+    assert await db_state(db_session) == (0, 65, sorted([first, second, third]), 35)
+    assert recovered.available(1) == 65
+    assert len(recovered.journal.segments()) == 1
+    assert os.path.getsize(recovered.journal.segments()[0]) == 0
+    await recovered.stop()
+
+
+@pytest.mark.asyncio
+async def test_release_returns_unused_stock(ledger, db_session):
+    await ledger.lease(1)
+
+    reservation_id = await ledger.reserve(1, 60, MOMENT)
+    assert await ledger.reserve(1, 50, MOMENT) is None
+    assert await ledger.release(1) == 40
+
+    assert await db_state(db_session) == (40, None, [reservation_id], 60)
+    assert not ledger.owns(1)
+    with pytest.raises(NotLeased):
+        await ledger.reserve(1, 1, MOMENT)
+
+
+@pytest.mark.asyncio
+async def test_release_waits_for_journal_write_in_progress(ledger, db_session, monkeypatch):
+    await ledger.lease(1)
+    started, proceed = threading.Event(), threading.Event()
+    sync_write = ledger.journal._sync_write
+
+    def slow_write(data, sync_directory):
+        started.set()
+        proceed.wait(5)
+        sync_write(data, sync_directory)
+
+    monkeypatch.setattr(ledger.journal, "_sync_write", slow_write)
+    reserve = asyncio.create_task(ledger.reserve(1, 30, MOMENT))
+    assert await asyncio.to_thread(started.wait, 5)
+
+    # Бронь ещё в fsync и не попала в pending: release не должен вернуть её остаток
+    release = asyncio.create_task(ledger.release(1))
+    await asyncio.sleep(0.05)
+    assert not release.done()
+    proceed.set()
+
+    reservation_id = await reserve
+    assert await release == 70
+    assert await db_state(db_session) == (70, None, [reservation_id], 30)
+
+
+@pytest.mark.asyncio
+async def test_reserve_endpoint_uses_ledger(client, db_session, ledger, monkeypatch):
+    monkeypatch.setattr(routes, "inventory_ledger", ledger)
+    db_session.add(ProductsModel(product_id=2, product_name="Regular Product", available_quantity=10))
+    await db_session.commit()
+    await ledger.lease(1)
+
+    payload = {"product_id": 1, "quantity": 10, "timestamp": "2024-09-04T12:00:00Z"}
+    response = await client.post("/reservation/reserve", json=payload)
+    assert response.status_code == 200
+    reservation_id = response.json()["reservation_id"]
+
+    # Обычное бронирование получает id после блока, выданного леджеру
+    response = await client.post("/reservation/reserve", json={**payload, "product_id": 2, "quantity": 1})
+    assert response.status_code == 200
+    regular_id = response.json()["reservation_id"]
+    assert regular_id > reservation_id
+
+    assert (await client.get(f"/reservation/{reservation_id}")).json() == {"status": "completed"}
+    assert (await client.get("/products/1")).json()["available_quantity"] == 90
+
+    response = await client.post("/reservation/reserve", json={**payload, "quantity": 91})
+    assert response.status_code == 400
+
+    await ledger.flush()
+    assert (await client.get(f"/reservation/{reservation_id}")).json() == {"status": "completed"}
+    assert await db_state(db_session) == (0, 90, [reservation_id, regular_id], 11)
+
+
+@pytest.mark.asyncio
+async def test_failed_journal_write_restores_stock(ledger, db_session, monkeypatch):
+    await ledger.lease(1)
+
+    def broken_write(data, sync_directory):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(ledger.journal, "_sync_write", broken_write)
+    with pytest.raises(OSError):
+        await ledger.reserve(1, 10, MOMENT)
+
+    assert ledger.available(1) == 100
+    assert ledger.pending == {}
+    assert await ledger.flush() == 0
+    assert await db_state(db_session) == (0, 100, [], 0)
+
+
+@pytest.mark.asyncio
+async def test_ledger_reserve_is_not_cut_off_by_deadline(client, db_session, ledger, monkeypatch):
+    import time
+
+    monkeypatch.setattr(routes, "inventory_ledger", ledger)
+    await ledger.lease(1)
+    sync_write = ledger.journal._sync_write
+
+    def slow_write(data, sync_directory):
+        time.sleep(0.05)
+        sync_write(data, sync_directory)
+
+    monkeypatch.setattr(ledger.journal, "_sync_write", slow_write)
+    payload = {"product_id": 1, "quantity": 1, "timestamp": "2024-09-04T12:00:00Z"}
+
+    # Срок истекает во время fsync: бронь уже списана, клиент получает её исход, а не 504
+    responses = [
+        await client.post("/reservation/reserve", json=payload, headers={"X-Request-Timeout-Ms": "10"})
+        for _ in range(3)
+    ]
+    assert [response.status_code for response in responses] == [200] * 3
+
+    await ledger.flush()
+    available, leased, ids, _ = await db_state(db_session)
+    assert (leased, len(ids)) == (97, 3)
+    assert sorted(response.json()["reservation_id"] for response in responses) == ids
+
+
+@pytest.mark.asyncio
+async def test_leased_product_skips_per_product_admission(client, ledger, monkeypatch):
+    from app.admission import admission_controller
+
+    monkeypatch.setattr(routes, "inventory_ledger", ledger)
+    await ledger.lease(1)
+    payload = {"product_id": 1, "quantity": 1, "timestamp": "2024-09-04T12:00:00Z"}
+
+    responses = await asyncio.gather(*(client.post("/reservation/reserve", json=payload) for _ in range(100)))
+
+    assert admission_controller.enabled
+    assert [response.status_code for response in responses] == [200] * 100
+    assert ledger.available(1) == 0
+
+
+@pytest.mark.asyncio
+async def test_lease_publishes_ledger_stock_and_blocks_set_import(client, db_session, ledger, monkeypatch):
+    from app.stream import stock_broadcaster
+
+    subscriber = stock_broadcaster.subscribe()
+    try:
+        await ledger.lease(1)
+        assert subscriber.drain() == (False, {1: 100})
+    finally:
+        stock_broadcaster.unsubscribe(subscriber)
+
+    response = await client.post("/products/import?mode=set", content="product_name,quantity\nTest Product,500\n")
+    data = response.json()
+    assert (data["products_updated"], data["rows_rejected"]) == (0, 1)
+    assert "leased" in data["errors"][0]
+
+    # Возврат аренды не складывает её с перезаписанным остатком
+    assert await ledger.release(1) == 100
+    assert (await db_state(db_session))[0] == 100
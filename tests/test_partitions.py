@@ -0,0 +1,83 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from app.partitions import (
+    encode_reservation_id,
+    month_index,
+    partition_index,
+    partition_name,
+    reservation_month_bounds,
+)
+
+
+def test_reservation_id_encodes_partition_month():
+    moment = datetime(2024, 9, 4, 12, 0, tzinfo=timezone.utc)
+    reservation_id = encode_reservation_id(moment, 42)
+
+    start, end = reservation_month_bounds(reservation_id)
+    assert start == datetime(2024, 9, 1, tzinfo=timezone.utc)
+    assert end == datetime(2024, 10, 1, tzinfo=timezone.utc)
+    assert start <= moment < end
+
+
+def test_reservation_id_december_rolls_over_year():
+    reservation_id = encode_reservation_id(datetime(2024, 12, 31, 23, 59, tzinfo=timezone.utc), 1)
+
+    start, end = reservation_month_bounds(reservation_id)
+    assert start == datetime(2024, 12, 1, tzinfo=timezone.utc)
+    assert end == datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def test_plain_reservation_id_has_no_partition():
+    assert reservation_month_bounds(12345) is None
+
+
+def test_partition_name_round_trip():
+    index = month_index(datetime(2025, 1, 15))
+
+    assert partition_name(index) == "reservations_p2025_01"
+    assert partition_index("reservations_p2025_01") == index
+    assert partition_index("reservations_default") is None
+
+
+class FakeConnection:
+    # Записывает SQL обслуживания секций вместо выполнения в Postgres
+    def __init__(self, default_months: list[datetime], fail_on: str):
+        self.default_months = default_months
+        self.fail_on = fail_on
+        self.statements: list[str] = []
+        self.rollbacks = 0
+
+    async def execute(self, statement, parameters=None):
+        from unittest.mock import MagicMock
+
+        sql = str(statement)
+        if self.fail_on in sql:
+            raise RuntimeError("partition constraint violated")
+        self.statements.append(sql)
+        result = MagicMock()
+        result.scalars.return_value = self.default_months if "reservations_default" in sql else []
+        return result
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        self.rollbacks += 1
+
+
+@pytest.mark.asyncio
+async def test_partition_creation_steps_are_isolated():
+    from app.partitions import create_upcoming_partitions
+
+    conn = FakeConnection(default_months=[datetime(2025, 1, 1)], fail_on="CREATE TABLE reservations_p2024_10")
+
+    created = await create_upcoming_partitions(conn, datetime(2024, 9, 15, tzinfo=timezone.utc), ahead=1)
+
+    assert created == ["reservations_p2024_09", "reservations_p2025_01"]
+    assert conn.rollbacks == 1
+    # Строки будущего месяца переносятся из default до ATTACH
+    january = [sql for sql in conn.statements if "reservations_p2025_01" in sql]
+    assert "DELETE FROM reservations_default" in january[1]
+    assert "ATTACH PARTITION" in january[2]
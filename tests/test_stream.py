@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from app.stream import StockBroadcaster, Subscriber, stock_events
+
+
+def test_subscriber_coalesces_updates_per_product():
+    subscriber = Subscriber(max_pending=2)
+
+    for quantity in (10, 9, 8):
+        assert subscriber.push(1, quantity)
+    assert subscriber.push(2, 5)
+
+    reset, pending = subscriber.drain()
+    assert not reset
+    assert pending == {1: 8, 2: 5}
+    assert not subscriber.ready.is_set()
+
+
+def test_slow_subscriber_is_dropped():
+    broadcaster = StockBroadcaster()
+    slow = broadcaster.subscribe()
+    slow.max_pending = 1
+
+    broadcaster.publish(1, 10)
+    broadcaster.publish(2, 10)
+
+    assert slow.dropped
+    assert slow not in broadcaster.subscribers
+
+
+def test_subscriber_limit():
+    from app.stream import TooManySubscribers
+
+    broadcaster = StockBroadcaster(max_subscribers=1)
+    broadcaster.subscribe()
+    with pytest.raises(TooManySubscribers):
+        broadcaster.subscribe()
+
+
+@pytest.mark.asyncio
+async def test_stock_events_stream():
+    broadcaster = StockBroadcaster()
+    events = stock_events(broadcaster, keepalive=0.01)
+    assert not broadcaster.subscribers
+
+    assert (await anext(events)).startswith("retry:")
+    (subscriber,) = broadcaster.subscribers
+    assert await anext(events) == ": keepalive\n\n"
+
+    broadcaster.publish(1, 90)
+    broadcaster.publish(1, 80)
+    chunk = await anext(events)
+    assert chunk == 'event: stock\ndata: {"product_id": 1, "available_quantity": 80}\n\n'
+
+    await events.aclose()
+    assert subscriber not in broadcaster.subscribers
+
+
+@pytest.mark.asyncio
+async def test_unstarted_stream_does_not_subscribe():
+    broadcaster = StockBroadcaster(max_subscribers=1)
+
+    # Клиент ушёл до первого чанка: генератор закрывают, не запустив
+    await stock_events(broadcaster).aclose()
+    assert not broadcaster.subscribers
+
+    broadcaster.subscribe()
+    events = stock_events(broadcaster)
+    assert await anext(events) == 'event: dropped\ndata: {"reason": "too many subscribers"}\n\n'
+    with pytest.raises(StopAsyncIteration):
+        await anext(events)
+
+
+@pytest.mark.asyncio
+async def test_reserve_publishes_stock_change(client, sample_product):
+    from app.stream import stock_broadcaster
+
+    subscriber = stock_broadcaster.subscribe()
+    try:
+        payload = {
+            "product_id": 1,
+            "quantity": 10,
+            "timestamp": "2024-09-04T12:00:00Z"
+        }
+        response = await client.post("/reservation/reserve", json=payload)
+        assert response.status_code == 200
+
+        await asyncio.wait_for(subscriber.ready.wait(), 1)
+        assert subscriber.drain() == (False, {1: 90})
+    finally:
+        stock_broadcaster.unsubscribe(subscriber)
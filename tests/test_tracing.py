@@ -0,0 +1,79 @@
+import logging
+
+import pytest
+
+from app import tracing
+from app.tracing import statement_label
+
+
+def completed_lines(caplog) -> list[str]:
+    return [record.getMessage() for record in caplog.records if record.getMessage().startswith("Completed request")]
+
+
+def test_statement_label():
+    assert statement_label("SELECT products.available_quantity \nFROM products WHERE ...") == "SELECT products"
+    assert statement_label('INSERT INTO "reservations" (product_id) VALUES ($1)') == "INSERT reservations"
+    assert statement_label("UPDATE products SET available_quantity=$1") == "UPDATE products"
+    assert statement_label("SELECT set_config('lock_timeout', $1, true)") == "SELECT"
+
+
+@pytest.mark.asyncio
+async def test_sampled_reserve_logs_trace(client, sample_product, caplog, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATE", 1.0)
+    caplog.set_level(logging.INFO, logger="app_logger")
+
+    response = await client.post("/reservation/reserve", json={
+        "product_id": 1,
+        "quantity": 10,
+        "timestamp": "2024-09-04T12:00:00Z",
+    })
+    assert response.status_code == 200
+
+    response = await client.get(f"/reservation/{response.json()['reservation_id']}")
+    assert response.status_code == 200
+
+    reserve_line, status_line = completed_lines(caplog)
+    # В SQLite бронирование выполняет последовательный писатель, трассировка доходит и до него
+    for phase in ("validation=", "checkout=", "sql:SELECT products=", "sql:UPDATE products=",
+                  "sql:INSERT reservations=", "commit=", "serialize=", "total="):
+        assert phase in reserve_line
+    assert reserve_line.index("validation=") < reserve_line.index("commit=") < reserve_line.index("serialize=")
+    assert "sql:SELECT reservations=" in status_line
+    assert "sql=1/" in status_line
+
+
+@pytest.mark.asyncio
+async def test_unsampled_requests_have_no_trace(client, sample_product, caplog, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATE", 0.0)
+    caplog.set_level(logging.INFO, logger="app_logger")
+
+    await client.get("/reservation/1")
+
+    assert completed_lines(caplog)
+    assert all("trace" not in line for line in completed_lines(caplog))
+    assert tracing.current_trace.get() is None
+
+
+@pytest.mark.asyncio
+async def test_slow_query_log(client, sample_product, caplog, monkeypatch):
+    monkeypatch.setattr(tracing, "SLOW_QUERY_MS", 1e-6)
+    caplog.set_level(logging.WARNING, logger="app_logger")
+
+    await client.get("/reservation/1")
+
+    slow = [record.getMessage() for record in caplog.records if record.getMessage().startswith("Slow query")]
+    assert any("(SELECT reservations)" in message for message in slow)
+
+
+@pytest.mark.asyncio
+async def test_failed_query_reaches_slow_query_log(db_session, caplog, monkeypatch):
+    from sqlalchemy import text
+
+    monkeypatch.setattr(tracing, "SLOW_QUERY_MS", 1e-6)
+    caplog.set_level(logging.WARNING, logger="app_logger")
+
+    with pytest.raises(Exception):
+        await db_session.execute(text("SELECT missing_column FROM products"))
+
+    slow = [record.getMessage() for record in caplog.records if record.getMessage().startswith("Slow query")]
+    assert any("(SELECT products) failed with" in message for message in slow)